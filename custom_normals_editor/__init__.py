@@ -31,7 +31,7 @@
 bl_info = {
 	"name": "Normals Editing Tools",
 	"author": "Andreas Wiehn (isathar)",
-	"version": (1, 0, 3),
+	"version": (1, 1, 0),
 	"blender": (2, 74, 0),
 	"location": "View3D > Toolbar",
 	"description": "Editing tools for vertex and split vertex normals",
@@ -44,6 +44,9 @@ bl_info = {
 import bpy
 
 from . import normeditor_functions
+from . import normeditor_kernels
+from . import normeditor_meshdata
+from . import normeditor_spatial
 
 
 # UI Panel
@@ -92,8 +95,24 @@ class cust_normals_panel(bpy.types.Panel):
 			box2.row().label("Mode:")
 			box2.row().prop(context.window_manager, 'vn_normalsgenmode',text='')
 			box2.row().prop(context.window_manager, 'vn_bendingratio',text='Ratio')
+			if context.window_manager.vn_normalsgenmode == 'BENT':
+				box2.row().prop(context.window_manager, 'vn_bentsource',text='')
+				if context.window_manager.vn_bentsource == 'OBJECTS':
+					box2.row().prop(context.window_manager, 'vn_bentfalloff',text='Falloff')
+			if context.window_manager.vn_normalsgenmode in normeditor_kernels.weight_kernels:
+				if context.active_object and context.active_object.type == 'MESH':
+					if context.active_object.data.use_auto_smooth:
+						box2.row().prop(context.window_manager, 'vn_autosplit',text='Auto Split')
+						if context.window_manager.vn_autosplit:
+							box2.row().prop(context.window_manager, 'vn_splitangle',text='Split Angle')
+							box2.row().prop(context.window_manager, 'vn_splitsharp',text='Split at Sharp Edges')
+							box2.row().prop(context.window_manager, 'vn_splitseams',text='Split at Seams')
 			if context.window_manager.vn_normalsgenmode == 'TRANS':
 				box2.row().prop(context.window_manager, 'normtrans_maxdist',text='Distance')
+				box2.row().prop(context.window_manager, 'normtrans_mode',text='')
+				if context.window_manager.normtrans_mode in {'INVDIST', 'GAUSSIAN'}:
+					box2.row().prop(context.window_manager, 'normtrans_knn',text='Neighbors')
+				box2.row().prop(context.window_manager, 'normtrans_average',text='Average Sources')
 			
 			box2.row().operator('object.cust_normals_generate',text='Generate')
 		
@@ -116,6 +135,10 @@ class cust_normals_panel(bpy.types.Panel):
 			row.operator('object.cust_normals_manualget')
 			
 			box2.row().operator('object.cust_normals_flipdir',text='Flip Direction')
+			row = box2.row(align=True)
+			row.operator('object.cust_normals_transform',text='Rotate').transform = 'ROTATE'
+			row.operator('object.cust_normals_transform',text='Mirror').transform = 'MIRROR'
+			row.operator('object.cust_normals_transform',text='Reflect').transform = 'REFLECT'
 			
 		
 
@@ -156,7 +179,11 @@ class PieMenu_CustNormalsBase(bpy.types.Menu):
 			pie.operator('object.cust_normals_applyvertsplit', text="Switch Mode", icon='OUTLINER_OB_EMPTY')
 		
 		pie.operator('object.cust_normals_flipdir', text='Flip', icon='MATSPHERE')
-		pie.operator('object.cust_normals_genweighted_area', text='Weighted', icon='MATCUBE')
+		col = pie.column()
+		col.operator('object.cust_normals_genweighted_area', text='Weighted', icon='MATCUBE')
+		col.operator('object.cust_normals_genweighted', text='Angle').kernel = 'ANGLE'
+		col.operator('object.cust_normals_genweighted', text='Area x Angle').kernel = 'AREAANGLE'
+		col.operator('object.cust_normals_genweighted', text='Edge Length').kernel = 'EDGELEN'
 		
 		pie.operator('object.cust_normals_genflat', text='Flat', icon='EDITMODE_HLT')
 		
@@ -175,9 +202,11 @@ def register():
 	bpy.utils.register_class(normeditor_functions.cust_normals_gendefault)
 	bpy.utils.register_class(normeditor_functions.cust_normals_gencustom)
 	bpy.utils.register_class(normeditor_functions.cust_normals_genweighted_area)
+	bpy.utils.register_class(normeditor_functions.cust_normals_genweighted)
 	bpy.utils.register_class(normeditor_functions.cust_normals_genbent)
 	bpy.utils.register_class(normeditor_functions.cust_normals_genflat)
 	bpy.utils.register_class(normeditor_functions.cust_normals_flipdir)
+	bpy.utils.register_class(normeditor_functions.cust_normals_transform)
 	bpy.utils.register_class(normeditor_functions.cust_normals_generate)
 	
 	# manual edit
@@ -224,9 +253,11 @@ def unregister():
 	bpy.utils.unregister_class(normeditor_functions.cust_normals_gendefault)
 	bpy.utils.unregister_class(normeditor_functions.cust_normals_gencustom)
 	bpy.utils.unregister_class(normeditor_functions.cust_normals_genweighted_area)
+	bpy.utils.unregister_class(normeditor_functions.cust_normals_genweighted)
 	bpy.utils.unregister_class(normeditor_functions.cust_normals_genbent)
 	bpy.utils.unregister_class(normeditor_functions.cust_normals_genflat)
 	bpy.utils.unregister_class(normeditor_functions.cust_normals_flipdir)
+	bpy.utils.unregister_class(normeditor_functions.cust_normals_transform)
 	bpy.utils.unregister_class(normeditor_functions.cust_normals_generate)
 	# manual edit
 	bpy.utils.unregister_class(normeditor_functions.cust_normals_enableediting)
@@ -244,6 +275,10 @@ def unregister():
 	# pie menu
 	bpy.utils.unregister_class(PieMenu_CustNormalsBase)
 	
+	# cached mesh data
+	normeditor_meshdata.meshcache.clear()
+	normeditor_spatial.clear_indices()
+	
 	clearvars(bpy)
 
 
@@ -262,19 +297,61 @@ def initdefaults(bpy):
 		description='Transfer distance, 0 for infinite',
 		subtype='DISTANCE',unit='LENGTH',
 		min=0.0,max=4096.0,soft_max=100.0,default=0.01)
+	types.WindowManager.normtrans_mode = bpy.props.EnumProperty(
+			name="Transfer Mode",
+			items=(('NEAREST', "Nearest", "Copy the nearest source normal"),
+					('INVDIST', "Inverse Distance", "Blend the nearest source normals weighted by inverse squared distance"),
+					('GAUSSIAN', "Gaussian", "Blend the nearest source normals with gaussian distance weights"),
+					('SURFACE', "Surface", "Interpolate the source normals at the closest point on the source surface (Blender 2.76+)")
+					),
+			default='NEAREST'
+			)
+	types.WindowManager.normtrans_knn = bpy.props.IntProperty(
+		default=4,min=1,max=32,
+		description='Number of nearest source vertices to blend')
+	types.WindowManager.normtrans_average = bpy.props.BoolProperty(
+		default=False,
+		description='Transfer from each selected object separately and average the results, instead of using the nearest across all of them')
 	
 	types.WindowManager.vn_normalsgenmode = bpy.props.EnumProperty(
 			name="Generate Mode",
 			items=(('DEFAULT', "Default", "Blender default"),
 					('SMOOTH', "Smooth", "Averaged normals"),
 					('WEIGHT', " Weighted ", "Averaged normals weighted by face area"),
-					('BENT', " Bent ", "Bent from cursor location"),
+					('ANGLE', " Angle ", "Averaged normals weighted by corner angle"),
+					('AREAANGLE', " Area x Angle ", "Averaged normals weighted by face area and corner angle"),
+					('EDGELEN', " Edge Length ", "Averaged normals weighted by inverse edge lengths"),
+					('BENT', " Bent ", "Bent away from the cursor or selected objects"),
 					('FLAT', " Flat ", "*Split normals only* Set normals to face normals"),
 					('TRANS', " Transfer ", "Transfer normals between objects")
 					),
 			default='DEFAULT'
 			)
 	
+	types.WindowManager.vn_bentsource = bpy.props.EnumProperty(
+			name="Bent Source",
+			items=(('CURSOR', "3D Cursor", "Bend away from the 3d cursor"),
+					('OBJECTS', "Selected Objects", "Bend away from the selected objects, empties act as proxy shapes by draw type (arrow: segment, cone: capsule, circle: plane, cube: box, sphere: sphere)")
+					),
+			default='CURSOR'
+			)
+	types.WindowManager.vn_bentfalloff = bpy.props.FloatProperty(
+		default=2.0,min=0.0,max=8.0,
+		description='Inverse distance exponent used to blend between attractors')
+	
+	types.WindowManager.vn_autosplit = bpy.props.BoolProperty(
+		default=False,
+		description='Average per smooth fan instead of per vertex (split normals only)')
+	types.WindowManager.vn_splitangle = bpy.props.FloatProperty(
+		subtype='ANGLE',min=0.0,max=3.14159,default=0.523599,
+		description='Split fans at edges with a face angle above this')
+	types.WindowManager.vn_splitsharp = bpy.props.BoolProperty(
+		default=True,
+		description='Split fans at edges marked sharp, and keep them marked')
+	types.WindowManager.vn_splitseams = bpy.props.BoolProperty(
+		default=False,
+		description='Split fans at UV seams')
+	
 	# Manual Edit
 	types.WindowManager.vn_dirvector = bpy.props.FloatVectorProperty(
 		default=(0.0,0.0,1.0),subtype='TRANSLATION',max=1.0,min=-1.0)
@@ -304,7 +381,9 @@ def initdefaults(bpy):
 def clearvars(bpy):
 	props = ['vn_bendingratio',
 		'vn_dirvector','vn_editselection','vn_editbyface','vn_normalsgenmode',
-		'normtrans_maxdist','vn_editmode_enabled',
+		'normtrans_maxdist','normtrans_mode','normtrans_knn','normtrans_average',
+		'vn_editmode_enabled','vn_bentsource','vn_bentfalloff',
+		'vn_autosplit','vn_splitangle','vn_splitsharp','vn_splitseams',
 		'panelui_show_generate','panelui_show_edit','panelui_show_transfer'
 	]
 	
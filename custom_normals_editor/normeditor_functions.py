@@ -18,52 +18,93 @@
 
 import bpy, bmesh
 from mathutils import Vector
+import numpy as np
+
+from .normeditor_kernels import (bent_normals, blend_normals, default_normals, fan_weighted_normals,
+	flat_normals, knn_normals, mirror_matrix, pick_normals, quaternion_matrix, reflect_normals,
+	surface_normals, transform_normals, vertex_loopnormals, weight_kernels, weighted_normals)
+from .normeditor_meshdata import (MeshSnapshot, meshcache, merged_normalsets, normalize_rows,
+	read_attribute)
+from .normeditor_spatial import BVHTree, build_index, surface_index
+
+
+# (count, 3) normals as one contiguous float buffer of (count * 3) floats
+def normals_to_buffer(normals):
+	return np.ascontiguousarray(normals, dtype=np.float32).reshape(-1)
+
+
+# clears all sharp edges in one bulk write, if there are any
+def clear_sharpedges(mesh):
+	sharpflags = read_attribute(mesh.edges, 'use_edge_sharp', bool)
+	if sharpflags.any():
+		sharpflags[:] = False
+		mesh.edges.foreach_set('use_edge_sharp', sharpflags)
+
+
+# resets sharp edges (unless keepsharp is set), validates the mesh only
+# if its topology changed since the last validated write
+# - topology: the mesh's MeshTopology from a snapshot of this run, looked up
+#   in meshcache if not given; validation state is kept on it
+def prepare_splitwrite(mesh, keepsharp=False, topology=None):
+	if not keepsharp:
+		clear_sharpedges(mesh)
+	
+	if topology is None:
+		topology = meshcache.topology(mesh)
+	if topology is None or not topology.validated:
+		# a changed mesh gets a new topology, validated on its next write
+		if not mesh.validate(clean_customdata=False) and topology is not None:
+			topology.validated = True
+
+
+# applies a flat (loops * 3) float buffer to the mesh's custom split normals
+def write_splitnormals(mesh, normsbuffer, keepsharp=False, topology=None):
+	prepare_splitwrite(mesh, keepsharp, topology)
+	mesh.normals_split_custom_set(normsbuffer.reshape(-1, 3))
+	mesh.free_normals_split()
+	mesh.update()
+
+
+# applies a flat (verts * 3) float buffer to the mesh's vertex normals
+# - bmesh is only used if the mesh is already in edit mode
+# - no mesh.update() in object mode, it would recalculate the normals
+# returns false if the buffer doesn't match the (edit) mesh's vertices
+def write_vertnormals(mesh, normsbuffer):
+	if mesh.is_editmode:
+		bm = bmesh.from_edit_mesh(mesh)
+		if len(bm.verts) * 3 != len(normsbuffer):
+			return False
+		
+		for v, n in zip(bm.verts, normsbuffer.reshape(-1, 3)):
+			v.normal = n
+		
+		bmesh.update_edit_mesh(mesh, tessface=False, destructive=False)
+		mesh.update()
+	else:
+		mesh.vertices.foreach_set('normal', normsbuffer)
+	
+	return True
 
 
 # picks split/vertex normals from input data, applies custom normals to mesh
+# - keepsharp: keep the mesh's sharp edges instead of resetting them (split normals)
 # returns true if normals were applied
-def update_customnormals(mesh, normalslist):
+def update_customnormals(mesh, normalslist, keepsharp=False, topology=None):
 	if len(normalslist) > 0:
 		if mesh.use_auto_smooth:
-			newnormslist = ()
-			
-			for f in normalslist:
-				newnormslist = newnormslist + tuple(tuple(n) for n in f)
+			normsbuffer = normals_to_buffer(normalslist)
+			if len(normsbuffer) != len(mesh.loops) * 3:
+				return False
 			
-			mesh.calc_normals_split()
-			
-			for e in mesh.edges:
-				e.use_edge_sharp = False
-			
-			mesh.validate(clean_customdata=False)
-			mesh.normals_split_custom_set(newnormslist)
-			mesh.free_normals_split()
-			mesh.update()
+			write_splitnormals(mesh, normsbuffer, keepsharp, topology)
 			return True
 			
 		else:
-			meshverts = []
-			if bpy.context.mode == 'EDIT_MESH':
-				bm = bmesh.from_edit_mesh(mesh)
-				meshverts = [v for v in bm.verts]
-				
-				for i in range(len(meshverts)):
-					meshverts[i].normal = normalslist[i].copy()
-				
-				bmesh.update_edit_mesh(mesh, tessface=False, destructive=False)
-				mesh.update()
-			else:
-				bm = bmesh.new()
-				bm.from_mesh(mesh)
-				meshverts = [v for v in bm.verts]
-				
-				for i in range(len(meshverts)):
-					meshverts[i].normal = normalslist[i].copy()
-				
-				bm.to_mesh(mesh)
+			normsbuffer = normals_to_buffer(normalslist)
+			if len(normsbuffer) != len(mesh.vertices) * 3:
+				return False
 			
-			del meshverts[:]
-			return True
+			return write_vertnormals(mesh, normsbuffer)
 	
 	return False
 
@@ -86,6 +127,8 @@ class cust_normals_generate(bpy.types.Operator):
 					return bpy.ops.object.cust_normals_gencustom.poll()
 				elif context.window_manager.vn_normalsgenmode == 'WEIGHT':
 					return bpy.ops.object.cust_normals_genweighted_area.poll()
+				elif context.window_manager.vn_normalsgenmode in weight_kernels:
+					return bpy.ops.object.cust_normals_genweighted.poll()
 				elif context.window_manager.vn_normalsgenmode == 'BENT':
 					return bpy.ops.object.cust_normals_genbent.poll()
 				elif context.window_manager.vn_normalsgenmode == 'FLAT':
@@ -104,6 +147,9 @@ class cust_normals_generate(bpy.types.Operator):
 			bpy.ops.object.cust_normals_gencustom({},'EXEC_DEFAULT',True)
 		elif context.window_manager.vn_normalsgenmode == 'WEIGHT':
 			bpy.ops.object.cust_normals_genweighted_area({},'EXEC_DEFAULT',True)
+		elif context.window_manager.vn_normalsgenmode in weight_kernels:
+			bpy.ops.object.cust_normals_genweighted({},'EXEC_DEFAULT',True,
+				kernel=context.window_manager.vn_normalsgenmode)
 		elif context.window_manager.vn_normalsgenmode == 'BENT':
 			bpy.ops.object.cust_normals_genbent({},'EXEC_DEFAULT',True)
 		elif context.window_manager.vn_normalsgenmode == 'FLAT':
@@ -138,125 +184,26 @@ class cust_normals_gendefault(bpy.types.Operator):
 	def execute(self, context):
 		mesh = context.active_object.data
 		bendratio = context.window_manager.vn_bendingratio
+		showselected = context.window_manager.vn_editselection
+		selectByFace = context.window_manager.vn_editbyface
 		
-		# using split normals
-		if context.active_object.data.use_auto_smooth:
-			tempverts = [v.select for v in mesh.vertices]
-			
-			mesh.calc_normals_split()
-			# get old normals
-			oldloopnorms = [v.normal.copy() for v in mesh.loops]
-			
-			# reset/generate default normals
-			for e in mesh.edges:
-				e.use_edge_sharp = False
-			mesh.validate(clean_customdata=False)
-			clearlist = tuple(tuple([0.0,0.0,0.0]) for i in range(len(mesh.vertices)))
-			mesh.normals_split_custom_set_from_vertices(clearlist)
-			mesh.free_normals_split()
-			
-			bpy.ops.object.shade_smooth()
-			mesh.update()
-			
-			newloopnorms = [v.normal.copy() for v in mesh.loops]
-			finalnorms = []
-			
-			lcount = 0
-			if context.window_manager.vn_editselection:
-				tempverts
-				for f in mesh.polygons:
-					for i in range(len(f.vertices)):
-						if f.select:
-							tempv = (oldloopnorms[lcount] * (1.0 - bendratio)) + (newloopnorms[lcount] * bendratio)
-						else:
-							tempv = oldloopnorms[lcount]
-						finalnorms.append(tempv)
-						lcount += 1
-			else:
-				for i in range(len(oldloopnorms)):
-					tempv = (oldloopnorms[i] * (1.0 - bendratio)) + (newloopnorms[i] * bendratio)
-					finalnorms.append(tempv)
-			
-			finalnormslist = []
-			loopcount = 0
-			for f in mesh.polygons:
-				fvns = []
-				for i in range(len(f.vertices)):
-					fvns.append(finalnorms[loopcount].copy())
-					loopcount += 1
-				finalnormslist.append(fvns)
-			
-			newnormslist = ()
-			for f in finalnormslist:
-				newnormslist = newnormslist + tuple(tuple(n) for n in f)
-			
-			for e in mesh.edges:
-				e.use_edge_sharp = False
-			mesh.validate(clean_customdata=False)
-			mesh.normals_split_custom_set(newnormslist)
-			mesh.free_normals_split()
-			mesh.update()
-			
-			del newloopnorms[:]
-			del oldloopnorms[:]
-			del tempverts[:]
-			del finalnorms[:]
-			del finalnormslist[:]
-			
-		# using vertex normals
-		else:
-			# create lists
-			vertslist = []
-			bm = None
-			if context.mode == 'OBJECT':
-				bm = bmesh.new()
-				bm.from_mesh(mesh)
-				vertslist = [v for v in bm.verts]
-			elif context.mode == 'EDIT_MESH':
-				bm = bmesh.from_edit_mesh(mesh)
-				vertslist = [v for v in bm.verts]
-			
-			orignormals = []
-			newnormals = []
-			
-			# get old normals
-			for v in vertslist:
-				orignormals.append(v.normal.copy())
-			
-			# recalc
-			bm.normal_update()
-			
-			# get new normals list
-			for v in vertslist:
-				newnormals.append(v.normal.copy())
-			
-			# calculate ratio, write to mesh
-			vcount = 0
-			if context.window_manager.vn_editselection:
-				for v in vertslist:
-					if v.select:
-						v.normal = ((orignormals[vcount] * (1.0 - bendratio)) + (newnormals[vcount] * bendratio)).normalized()
-					else:
-						v.normal = orignormals[vcount]
-					vcount += 1
-			else:
-				for v in vertslist:
-					tempv = ((orignormals[vcount] * (1.0 - bendratio)) + (newnormals[vcount] * bendratio)).normalized()
-					v.normal = tempv.copy()
-					vcount += 1
-			
-			if context.mode == 'OBJECT':
-				bm.to_mesh(mesh)
-			else:
-				bmesh.update_edit_mesh(mesh, tessface=False, destructive=False)
-			
-			# cleanup
-			del vertslist[:]
-			del orignormals[:]
-			del newnormals[:]
-			
-		context.area.tag_redraw()
-		context.scene.update()
+		# build lists
+		meshdata = MeshSnapshot(mesh)
+		elems = meshdata.elem_indices(showselected, selectByFace)
+		
+		# calculate default normals from the geometry, blend with the current ones
+		autosmoothangle = mesh.auto_smooth_angle if meshdata.split else None
+		normalsdata_proc = blend_normals(
+			meshdata.normals, default_normals(meshdata, autosmoothangle, elems), bendratio, elems)
+		
+		# custom split normals only show on smooth faces
+		if meshdata.split:
+			mesh.polygons.foreach_set('use_smooth', np.ones(meshdata.numpolys, dtype=bool))
+		
+		# apply new normals to the mesh
+		if (update_customnormals(mesh, normalsdata_proc, topology=meshdata.geometry.topology)):
+			context.area.tag_redraw()
+			context.scene.update()
 		
 		return {'FINISHED'}
 	
@@ -269,10 +216,40 @@ class cust_normals_gendefault(bpy.types.Operator):
 
 
 # - Bent -
+
+# proxy shapes of empties used as Bent attractors, by draw type
+bent_emptyshapes = {
+	'SINGLE_ARROW': 'ARROW',
+	'CONE': 'CAPSULE',
+	'CIRCLE': 'PLANE',
+	'CUBE': 'BOX',
+	'SPHERE': 'SPHERE',
+}
+
+
+# Bent attractors from the selected objects other than the active one
+# - empties use their draw type as proxy shape, sized by their draw size
+# - other objects are points at their origin
+# - optional 'vn_falloff' custom property: radius of the attractor's influence
+def get_bentattractors(context):
+	attractors = []
+	for obj in context.selected_objects:
+		if obj != context.active_object:
+			matrix = np.array(obj.matrix_world, dtype=np.float64)
+			shape = 'POINT'
+			if obj.type == 'EMPTY':
+				shape = bent_emptyshapes.get(obj.empty_draw_type, 'POINT')
+				matrix[:3, :3] *= obj.empty_draw_size
+			
+			attractors.append((matrix, shape, float(obj.get('vn_falloff', 0.0))))
+	
+	return attractors
+
+
 class cust_normals_genbent(bpy.types.Operator):
 	bl_idname = 'object.cust_normals_genbent'
 	bl_label = 'Bent'
-	bl_description = 'Calculate normals bent away from 3d cursor'
+	bl_description = 'Calculate normals bent away from the 3d cursor or selected objects'
 	bl_options = {'REGISTER', 'UNDO'}
 	
 	@classmethod
@@ -285,103 +262,117 @@ class cust_normals_genbent(bpy.types.Operator):
 		return False
 	
 	def execute(self, context):
-		editsplit = context.active_object.data.use_auto_smooth
-		cursorloc = context.scene.cursor_location
 		bendratio = abs(context.window_manager.vn_bendingratio)
+		editselection = context.window_manager.vn_editselection
+		selectByFace = context.window_manager.vn_editbyface
 		mesh = context.active_object.data
 		
-		# build lists
-		normalsdata = []
-		normalsdata_proc = []
-		
-		if editsplit:
-			editselection = bpy.context.window_manager.vn_editselection
-			selectByFace = bpy.context.window_manager.vn_editbyface
-			
-			mesh.calc_normals_split()
-			
-			vertslist = [[(v.co).copy(), v.select] for v in mesh.vertices]
-			loopnorms_raw = [(l.normal).copy() for l in mesh.loops]
-			
-			loopcount = 0
-			
-			for f in mesh.polygons:
-				fvn = []
-				fvco = []
-				fvsel = []
-				
-				for v in f.vertices:
-					fvco.append(vertslist[v][0].copy())
-					fvn.append(loopnorms_raw[loopcount].copy())
-					
-					if editselection:
-						if selectByFace:
-							fvsel.append(f.select)
-						else:
-							fvsel.append(vertslist[v][1])
-					else:
-						fvsel.append(True)
-					loopcount += 1
-				
-				normalsdata.append([fvco,fvn,fvsel])
-				normalsdata_proc.append(fvn)
-			
-			mesh.free_normals_split()
-			
-			del vertslist[:]
-			del loopnorms_raw[:]
-			
+		if context.window_manager.vn_bentsource == 'OBJECTS':
+			attractors = get_bentattractors(context)
 		else:
-			editselection = bpy.context.window_manager.vn_editselection
-			normalsdata = [[],[],[]]
-			
-			for v in mesh.vertices:
-				normalsdata[0].append((v.co).copy())
-				normalsdata[1].append((v.normal).copy())
-				normalsdata_proc.append((v.normal).copy())
-				if editselection:
-					normalsdata[2].append(v.select)
-				else:
-					normalsdata[2].append(True)
-		
-		# calculate new normals
-		if editsplit:
-			for i in range(len(normalsdata)):
-				for j in range(len(normalsdata[i][0])):
-					if normalsdata[i][2][j]:
-						tempv = (normalsdata[i][0][j] - cursorloc).normalized()
-						tempv = normalsdata[i][1][j] * (1.0 - bendratio) + (tempv * bendratio)
-						normalsdata_proc[i][j] = tempv.normalized()
+			cursormatrix = np.identity(4)
+			cursormatrix[:3, 3] = context.scene.cursor_location
+			attractors = [(cursormatrix, 'POINT', 0.0)]
+		
+		if len(attractors) > 0:
+			# build lists
+			meshdata = MeshSnapshot(mesh)
+			elems = meshdata.elem_indices(editselection, selectByFace)
+			
+			# calculate new normals
+			bentnormals, reached = bent_normals(
+				meshdata, context.active_object.matrix_world, attractors,
+				context.window_manager.vn_bentfalloff, elems)
+			if elems is None:
+				elems = np.arange(meshdata.numelems, dtype=np.int32)
+			normalsdata_proc = blend_normals(
+				meshdata.normals, bentnormals[reached], bendratio, elems[reached])
+			
+			# apply new normals to the mesh
+			if (update_customnormals(mesh, normalsdata_proc, topology=meshdata.geometry.topology)):
+				context.area.tag_redraw()
+				context.scene.update()
 		else:
-			for i in range(len(normalsdata[0])):
-				if normalsdata[2][i]:
-					tempv = (normalsdata[0][i] - cursorloc).normalized()
-					tempv = normalsdata[1][i] * (1.0 - bendratio) + (tempv * bendratio)
-					normalsdata_proc[i] = tempv.normalized()
-		
-		# free some memory
-		del normalsdata[:]
-		
-		# apply new normals to the mesh
-		if (update_customnormals(mesh, normalsdata_proc)):
-			context.area.tag_redraw()
-			context.scene.update()
-		
-		# cleanup
-		del normalsdata_proc[:]
+			print('No attractors selected')
 		
 		return {'FINISHED'}
 	
 	def draw(self, context):
 		layout = self.layout
 		layout.column().prop(context.window_manager, 'vn_bendingratio', text='Amount')
+		layout.column().prop(context.window_manager, 'vn_bentsource', text='')
+		if context.window_manager.vn_bentsource == 'OBJECTS':
+			layout.column().prop(context.window_manager, 'vn_bentfalloff', text='Falloff')
 		layout.column().prop(context.window_manager, 'vn_editselection', text='Selected Only')
 		if context.active_object.data.use_auto_smooth:
 			layout.column().prop(context.window_manager, 'vn_editbyface', text='Face Selection')
 
 
+# edges marked to split smooth fans: sharp and/or seam flags, None if neither is used
+def get_hardedges(mesh, sharp, seams):
+	hardedges = None
+	if sharp:
+		hardedges = read_attribute(mesh.edges, 'use_edge_sharp', bool)
+	if seams:
+		seamflags = read_attribute(mesh.edges, 'use_seam', bool)
+		hardedges = seamflags if hardedges is None else (hardedges | seamflags)
+	return hardedges
+
+
+# shared by the weighted average generators (Smooth, Weighted, ...)
+# - kernel: weighting mode, see normeditor_kernels.weight_kernels
+# - auto split (split normals only): averages per smooth fan instead of per vertex,
+#   fans are split at the split angle and optionally at sharp/seam edges
+def generate_weighted(context, kernel):
+	# gather vars
+	showselected = context.window_manager.vn_editselection
+	selectByFace = context.window_manager.vn_editbyface
+	bendratio = context.window_manager.vn_bendingratio
+	autosplit = context.window_manager.vn_autosplit
+	splitsharp = context.window_manager.vn_splitsharp
+	
+	mesh = context.active_object.data
+	
+	# build lists
+	meshdata = MeshSnapshot(mesh)
+	elems = meshdata.elem_indices(showselected, selectByFace)
+	autosplit = autosplit and meshdata.split
+	
+	facemask = None
+	if showselected and selectByFace:
+		facemask = meshdata.poly_select
+	
+	# create new normals
+	if autosplit:
+		hardedges = get_hardedges(mesh, splitsharp, context.window_manager.vn_splitseams)
+		newnormals = fan_weighted_normals(
+			meshdata, kernel, context.window_manager.vn_splitangle, hardedges, facemask, elems)
+	else:
+		newnormals = weighted_normals(meshdata, kernel, facemask, elems)
+	normalsdata_proc = blend_normals(meshdata.normals, newnormals, bendratio, elems)
+	
+	# apply new normals to the mesh, marked sharp edges are kept if fans were split at them
+	if (update_customnormals(mesh, normalsdata_proc, keepsharp=(autosplit and splitsharp),
+			topology=meshdata.geometry.topology)):
+		context.area.tag_redraw()
+		context.scene.update()
+	
+	return {'FINISHED'}
+
+
+# redo panel of the weighted average generators
+def draw_weighted(layout, context):
+	layout.column().prop(context.window_manager, 'vn_bendingratio', text='Amount')
+	layout.column().prop(context.window_manager, 'vn_editselection', text='Selected Only')
+	if context.active_object.data.use_auto_smooth:
+		layout.column().prop(context.window_manager, 'vn_autosplit', text='Auto Split')
+		if context.window_manager.vn_autosplit:
+			layout.column().prop(context.window_manager, 'vn_splitangle', text='Split Angle')
+			layout.column().prop(context.window_manager, 'vn_splitsharp', text='Split at Sharp Edges')
+			layout.column().prop(context.window_manager, 'vn_splitseams', text='Split at Seams')
+
+
 # - Smooth (Averaged) -
-# TBD: add dot product range for automatic splits
 class cust_normals_gencustom(bpy.types.Operator):
 	bl_idname = 'object.cust_normals_gencustom'
 	bl_label = 'Smooth'
@@ -398,135 +389,10 @@ class cust_normals_gencustom(bpy.types.Operator):
 		return False
 	
 	def execute(self, context):
-		# gather vars
-		editsplit = context.active_object.data.use_auto_smooth
-		showselected = context.window_manager.vn_editselection
-		selectByFace = context.window_manager.vn_editbyface
-		bendratio = context.window_manager.vn_bendingratio
-		
-		mesh = context.active_object.data
-		bm = None
-		if context.mode == 'EDIT_MESH':
-			bm = bmesh.from_edit_mesh(mesh)
-		elif context.mode == 'OBJECT':
-			bm = bmesh.new()
-			bm.from_mesh(mesh)
-		
-		# build lists
-		lfindex = []
-		normalsdata = []
-		normalsdata_proc = []
-		
-		if editsplit:
-			mesh.calc_normals_split()
-			
-			vertslist = [[(v.co).copy(), v.select] for v in mesh.vertices]
-			loopnorms_raw = [(l.normal).copy() for l in mesh.loops]
-			
-			loopcount = 0
-			
-			for f in mesh.polygons:
-				fvn = []
-				fvco = []
-				fvsel = []
-				
-				for v in f.vertices:
-					fvco.append(vertslist[v][0].copy())
-					fvn.append(loopnorms_raw[loopcount].copy())
-					
-					if showselected:
-						if selectByFace:
-							fvsel.append(f.select)
-						else:
-							fvsel.append(vertslist[v][1])
-					else:
-						fvsel.append(True)
-					loopcount += 1
-				
-				normalsdata.append([fvco,fvn,fvsel])
-				normalsdata_proc.append(fvn)
-			
-			mesh.free_normals_split()
-			
-			del vertslist[:]
-			del loopnorms_raw[:]
-			
-			faceslist = [f for f in bm.faces]
-			lfindex = [[] for i in range(len(normalsdata))]
-			
-			for i in range(len(normalsdata)):
-				for v in faceslist[i].verts:
-					if showselected:
-						if selectByFace:
-							lfindex[i].append([[vf.normal, vf.select] for vf in v.link_faces])
-						else:
-							lfindex[i].append([[vf.normal, v.select] for vf in v.link_faces])
-					else:
-						lfindex[i].append([[vf.normal, True] for vf in v.link_faces])
-			
-			del faceslist[:]
-		else:
-			normalsdata = [[],[],[]]
-			
-			for v in mesh.vertices:
-				normalsdata[0].append((v.co).copy())
-				normalsdata[1].append((v.normal).copy())
-				normalsdata_proc.append((v.normal).copy())
-				if showselected:
-					normalsdata[2].append(v.select)
-				else:
-					normalsdata[2].append(True)
-			
-			for v in bm.verts:
-				if showselected:
-					if selectByFace:
-						lfindex.append([[vf.normal, vf.select] for vf in v.link_faces])
-					else:
-						lfindex.append([[vf.normal, v.select] for vf in v.link_faces])
-				else:
-					lfindex.append([[vf.normal, True] for vf in v.link_faces])
-		
-		# create new normals
-		if editsplit:
-			for i in range(len(normalsdata)):
-				for j in range(len(normalsdata[i][1])):
-					if normalsdata[i][2][j]:
-						tempfvect = Vector((0.0,0.0,0.0))
-						for vf in lfindex[i][j]:
-							if vf[1]:
-								tempfvect = tempfvect + vf[0].copy()
-						
-						tempv = (normalsdata[i][1][j] * (1.0 - bendratio)) + ((tempfvect).normalized() * bendratio)
-						normalsdata_proc[i][j] = tempv.normalized()
-			
-		else:
-			for i in range(len(normalsdata[1])):
-				if normalsdata[2][i]:
-					tempfvect = Vector((0.0,0.0,0.0))
-					for j in range(len(lfindex[i])):
-						if (lfindex[i][j][1]):
-							tempfvect = tempfvect + (lfindex[i][j][0]).copy()
-					
-					tempv = (normalsdata[1][i] * (1.0 - bendratio)) + ((tempfvect).normalized() * bendratio)
-					normalsdata_proc[i] = tempv.normalized()
-		
-		del lfindex[:]
-		del normalsdata[:]
-		
-		# apply new normals to the mesh
-		if (update_customnormals(mesh, normalsdata_proc)):
-			context.area.tag_redraw()
-			context.scene.update()
-		
-		# clean up
-		del normalsdata_proc[:]
-		
-		return {'FINISHED'}
+		return generate_weighted(context, 'SMOOTH')
 	
 	def draw(self, context):
-		layout = self.layout
-		layout.column().prop(context.window_manager, 'vn_bendingratio', text='Amount')
-		layout.column().prop(context.window_manager, 'vn_editselection', text='Selected Only')
+		draw_weighted(self.layout, context)
 
 
 # - Weighted (face area / vertex) -
@@ -546,131 +412,46 @@ class cust_normals_genweighted_area(bpy.types.Operator):
 		return False
 	
 	def execute(self, context):
-		# gather vars
-		editsplit = context.active_object.data.use_auto_smooth
-		showselected = context.window_manager.vn_editselection
-		selectByFace = context.window_manager.vn_editbyface
-		bendratio = context.window_manager.vn_bendingratio
-		
-		mesh = context.active_object.data
-		bm = None
-		if context.mode == 'EDIT_MESH':
-			bm = bmesh.from_edit_mesh(mesh)
-		elif context.mode == 'OBJECT':
-			bm = bmesh.new()
-			bm.from_mesh(mesh)
-			
-		normalsdata = []
-		normalsdata_proc = []
-		lfindex = []
-		
-		# build lists
-		if editsplit:
-			mesh.calc_normals_split()
-			
-			vertslist = [[(v.co).copy(), v.select] for v in mesh.vertices]
-			loopnorms_raw = [(l.normal).copy() for l in mesh.loops]
-			
-			loopcount = 0
-			
-			for f in mesh.polygons:
-				fvn = []
-				fvco = []
-				fvsel = []
-				
-				for v in f.vertices:
-					fvco.append(vertslist[v][0].copy())
-					fvn.append(loopnorms_raw[loopcount].copy())
-					
-					if showselected:
-						if selectByFace:
-							fvsel.append(f.select)
-						else:
-							fvsel.append(vertslist[v][1])
-					else:
-						fvsel.append(True)
-					loopcount += 1
-				
-				normalsdata.append([fvco,fvn,fvsel])
-				normalsdata_proc.append(fvn)
-			
-			mesh.free_normals_split()
-			
-			del vertslist[:]
-			del loopnorms_raw[:]
-			
-			faceslist = [f for f in bm.faces]
-			lfindex = [[] for i in range(len(normalsdata))]
-			
-			for i in range(len(normalsdata)):
-				for v in faceslist[i].verts:
-					if showselected:
-						if selectByFace:
-							lfindex[i].append([[vf.normal, vf.select, vf.calc_area()] for vf in v.link_faces])
-						else:
-							lfindex[i].append([[vf.normal, v.select, vf.calc_area()] for vf in v.link_faces])
-					else:
-						lfindex[i].append([[vf.normal, True, vf.calc_area()] for vf in v.link_faces])
-			
-			del faceslist[:]
-		else:
-			normalsdata = [[],[],[]]
-			
-			for v in mesh.vertices:
-				normalsdata[0].append((v.co).copy())
-				normalsdata[1].append((v.normal).copy())
-				normalsdata_proc.append((v.normal).copy())
-				if showselected:
-					normalsdata[2].append(v.select)
-				else:
-					normalsdata[2].append(True)
-			
-			for v in bm.verts:
-				if showselected:
-					lfindex.append([[vf.normal, v.select, vf.calc_area()] for vf in v.link_faces])
-				else:
-					lfindex.append([[vf.normal, True, vf.calc_area()] for vf in v.link_faces])
-		
-		# create new normals
-		if editsplit:
-			for i in range(len(normalsdata)):
-				for j in range(len(normalsdata[i][1])):
-					if normalsdata[i][2][j]:
-						tempfvect = Vector((0.0,0.0,0.0))
-						for vf in lfindex[i][j]:
-							if vf[1]:
-								tempfvect = tempfvect + (vf[0].copy() * vf[2])
-						
-						tempv = (normalsdata[i][1][j] * (1.0 - bendratio)) + ((tempfvect).normalized() * bendratio)
-						normalsdata_proc[i][j] = tempv.normalized()
-		else:
-			for i in range(len(normalsdata[1])):
-				if normalsdata[2][i]:
-					tempfvect = Vector((0.0,0.0,0.0))
-					for j in range(len(lfindex[i])):
-						if (lfindex[i][j][1]):
-							tempfvect = tempfvect + ((lfindex[i][j][0]).copy() * lfindex[i][j][2])
-					
-					tempv = (normalsdata[1][i] * (1.0 - bendratio)) + ((tempfvect).normalized() * bendratio)
-					normalsdata_proc[i] = tempv.normalized()
-		
-		del lfindex[:]
-		del normalsdata[:]
-		
-		# apply new normals to the mesh
-		if (update_customnormals(mesh, normalsdata_proc)):
-			context.area.tag_redraw()
-			context.scene.update()
-		
-		# clean up
-		del normalsdata_proc[:]
-		
-		return {'FINISHED'}
+		return generate_weighted(context, 'WEIGHT')
+	
+	def draw(self, context):
+		draw_weighted(self.layout, context)
+
+
+# - Weighted (any weighting kernel) -
+class cust_normals_genweighted(bpy.types.Operator):
+	bl_idname = 'object.cust_normals_genweighted'
+	bl_label = 'Weighted Average'
+	bl_description = 'Custom normals using averaged face normals with selectable weights'
+	bl_options = {'REGISTER', 'UNDO'}
+	
+	kernel = bpy.props.EnumProperty(
+		name='Weights',
+		items=(('SMOOTH', "Uniform", "Unweighted average"),
+				('WEIGHT', "Face Area", "Weighted by face area"),
+				('ANGLE', "Corner Angle", "Weighted by the face's corner angle at the vertex"),
+				('AREAANGLE', "Area x Angle", "Weighted by face area and corner angle"),
+				('EDGELEN', "Inverse Edge Length", "Weighted by the inverse lengths of the corner's edges")
+				),
+		default='ANGLE'
+		)
+	
+	@classmethod
+	def poll(cls, context):
+		if context.active_object:
+			if context.active_object.type == 'MESH':
+				if context.active_object.data.use_auto_smooth:
+					return context.mode == 'OBJECT'
+				return True
+		return False
+	
+	def execute(self, context):
+		return generate_weighted(context, self.kernel)
 	
 	def draw(self, context):
 		layout = self.layout
-		layout.column().prop(context.window_manager, 'vn_bendingratio', text='Amount')
-		layout.column().prop(context.window_manager, 'vn_editselection', text='Selected Only')
+		layout.column().prop(self, 'kernel', text='Weights')
+		draw_weighted(layout, context)
 
 
 # - Flat -
@@ -696,73 +477,20 @@ class cust_normals_genflat(bpy.types.Operator):
 		
 		mesh = context.active_object.data
 		mesh.update()
-		mesh.calc_normals_split()
 		
 		# build lists
-			
-		vertslist = [[(v.co).copy(), v.select] for v in mesh.vertices]
-		loopnorms_raw = [(l.normal).copy() for l in mesh.loops]
-		
-		loopcount = 0
-		
-		normalsdata = []
-		normalsdata_proc = []
-		
-		for f in mesh.polygons:
-			fvn = []
-			fvco = []
-			fvsel = []
-			
-			for v in f.vertices:
-				fvco.append(vertslist[v][0].copy())
-				fvn.append(loopnorms_raw[loopcount].copy())
-				
-				if showselected:
-					if selectByFace:
-						fvsel.append(f.select)
-					else:
-						fvsel.append(vertslist[v][1])
-				else:
-					fvsel.append(True)
-				loopcount += 1
-			
-			normalsdata.append([fvco,fvn,fvsel])
-			normalsdata_proc.append(fvn)
-		
-		mesh.free_normals_split()
-		
-		del vertslist[:]
-		del loopnorms_raw[:]
+		meshdata = MeshSnapshot(mesh, split=True)
+		elems = meshdata.elem_indices(showselected, selectByFace)
 		
 		# create new normals
-		fcount = 0
-		if context.window_manager.vn_editselection:
-			for f in mesh.polygons:
-				for i in range(len(f.vertices)):
-					if normalsdata[fcount][2][i]:
-						normalsdata_proc[fcount][i] = (
-							(normalsdata[fcount][1][i] 
-							* (1.0 - bendratio)) 
-							+ (f.normal.copy() 
-							* bendratio)
-						).normalized()
-				fcount += 1
-		else:
-			for f in mesh.polygons:
-				for i in range(len(f.vertices)):
-					normalsdata_proc[fcount][i] = ((normalsdata[fcount][1][i] * (1.0 - bendratio)) + (f.normal.copy() * bendratio)).normalized()
-				fcount += 1
-		
-		del normalsdata[:]
+		normalsdata_proc = blend_normals(
+			meshdata.normals, flat_normals(meshdata, elems), bendratio, elems)
 		
 		# apply new normals to the mesh
-		if (update_customnormals(mesh, normalsdata_proc)):
+		if (update_customnormals(mesh, normalsdata_proc, topology=meshdata.geometry.topology)):
 			context.area.tag_redraw()
 			context.scene.update()
 		
-		# clean up
-		del normalsdata_proc[:]
-		
 		return {'FINISHED'}
 	
 	def draw(self, context):
@@ -791,93 +519,106 @@ class cust_normals_flipdir(bpy.types.Operator):
 	
 	def execute(self, context):
 		# gather vars
-		editsplit = context.active_object.data.use_auto_smooth
 		showselected = context.window_manager.vn_editselection
+		selectByFace = context.window_manager.vn_editbyface
 		
 		mesh = context.active_object.data
 		
-		meshverts = []
-		if context.mode == 'EDIT_MESH':
-			bm = bmesh.from_edit_mesh(mesh)
-			meshverts = [v for v in bm.verts]
-		elif context.mode == 'OBJECT':
-			bm = bmesh.new()
-			bm.from_mesh(mesh)
-			meshverts = [v for v in bm.verts]
-		
 		# build lists
-		normalsdata = []
-		normalsdata_proc = []
+		meshdata = MeshSnapshot(mesh)
+		elems = meshdata.elem_indices(showselected, selectByFace)
 		
-		if editsplit:
-			mesh.calc_normals_split()
-			
-			vertslist = [[(v.co).copy(), v.select] for v in mesh.vertices]
-			loopnorms_raw = [(l.normal).copy() for l in mesh.loops]
-			
-			loopcount = 0
-			
-			for f in mesh.polygons:
-				fvn = []
-				fvco = []
-				fvsel = []
-				
-				for v in f.vertices:
-					fvco.append(vertslist[v][0].copy())
-					fvn.append(loopnorms_raw[loopcount].copy())
-					
-					if showselected:
-						if selectByFace:
-							fvsel.append(f.select)
-						else:
-							fvsel.append(vertslist[v][1])
-					else:
-						fvsel.append(True)
-					loopcount += 1
-				
-				normalsdata.append([fvco,fvn,fvsel])
-				normalsdata_proc.append(fvn)
-			
-			mesh.free_normals_split()
-			
-			del vertslist[:]
-			del loopnorms_raw[:]
-			
-		else:
-			normalsdata = [[],[],[]]
-			
-			for v in mesh.vertices:
-				normalsdata[0].append((v.co).copy())
-				normalsdata[1].append((v.normal).copy())
-				normalsdata_proc.append((v.normal).copy())
-				if showselected:
-					normalsdata[2].append(v.select)
-				else:
-					normalsdata[2].append(True)
+		# flip normals in list
+		normalsdata_proc = transform_normals(meshdata.normals, -np.identity(3), elems)
 		
+		# apply new normals to the mesh
+		if (update_customnormals(mesh, normalsdata_proc, topology=meshdata.geometry.topology)):
+			context.area.tag_redraw()
+			context.scene.update()
 		
-		# flip normals in list
-		if editsplit:
-			for i in range(len(normalsdata)):
-				for j in range(len(normalsdata[i][1])):
-					if normalsdata[i][2][j]:
-						normalsdata_proc[i][j] = normalsdata[i][1][j] * -1.0
-		else:
-			for i in range(len(normalsdata[1])):
-				if normalsdata[2][i]:
-					normalsdata_proc[i] = normalsdata[1][i] * -1.0
+		return {'FINISHED'}
+
+
+# - Transform (flip, rotate, mirror, reflect) -
+class cust_normals_transform(bpy.types.Operator):
+	bl_idname = 'object.cust_normals_transform'
+	bl_label = 'Transform'
+	bl_description = 'Flip, rotate, mirror or reflect selected normals'
+	bl_options = {'REGISTER', 'UNDO'}
+	
+	transform = bpy.props.EnumProperty(
+		name='Transform',
+		items=(('FLIP', "Flip", "Reverse the normals"),
+				('ROTATE', "Rotate", "Rotate the normals"),
+				('MIRROR', "Mirror", "Mirror the normals across an axis plane"),
+				('REFLECT', "Reflect", "Reflect the normals about the surface tangent plane")
+				),
+		default='ROTATE'
+		)
+	rotation = bpy.props.FloatVectorProperty(
+		name='Rotation',size=4,subtype='QUATERNION',
+		default=(1.0,0.0,0.0,0.0))
+	axis = bpy.props.EnumProperty(
+		name='Axis',
+		items=(('X', "X", "Mirror across the YZ plane"),
+				('Y', "Y", "Mirror across the XZ plane"),
+				('Z', "Z", "Mirror across the XY plane")
+				),
+		default='X'
+		)
+	
+	@classmethod
+	def poll(cls, context):
+		if context.active_object:
+			if context.active_object.type == 'MESH':
+				if context.active_object.data.use_auto_smooth:
+					return context.mode == 'OBJECT'
+				return True
+		return False
+	
+	def execute(self, context):
+		# gather vars
+		showselected = context.window_manager.vn_editselection
+		selectByFace = context.window_manager.vn_editbyface
+		
+		mesh = context.active_object.data
 		
-		del normalsdata[:]
+		# build lists
+		meshdata = MeshSnapshot(mesh)
+		elems = meshdata.elem_indices(showselected, selectByFace)
+		normalsdata_proc = meshdata.normals
+		
+		# transform normals in list
+		if self.transform == 'FLIP':
+			transform_normals(normalsdata_proc, -np.identity(3), elems)
+		elif self.transform == 'ROTATE':
+			transform_normals(normalsdata_proc, quaternion_matrix(self.rotation), elems)
+		elif self.transform == 'MIRROR':
+			transform_normals(normalsdata_proc, mirror_matrix('XYZ'.index(self.axis)), elems)
+		elif self.transform == 'REFLECT':
+			if meshdata.split:
+				surfacenormals = flat_normals(meshdata, elems)
+			else:
+				surfacenormals = weighted_normals(meshdata, 'ANGLE', elems=elems)
+			reflect_normals(normalsdata_proc, surfacenormals, elems)
 		
 		# apply new normals to the mesh
-		if (update_customnormals(mesh, normalsdata_proc)):
+		if (update_customnormals(mesh, normalsdata_proc, topology=meshdata.geometry.topology)):
 			context.area.tag_redraw()
 			context.scene.update()
 		
-		# clean up
-		del normalsdata_proc[:]
-		
 		return {'FINISHED'}
+	
+	def draw(self, context):
+		layout = self.layout
+		layout.column().prop(self, 'transform', text='')
+		if self.transform == 'ROTATE':
+			layout.column().prop(self, 'rotation', text='')
+		elif self.transform == 'MIRROR':
+			layout.row().prop(self, 'axis', expand=True)
+		layout.column().prop(context.window_manager, 'vn_editselection', text='Selected Only')
+		if context.active_object.data.use_auto_smooth:
+			layout.column().prop(context.window_manager, 'vn_editbyface', text='Face Selection')
 
 
 ####################################
@@ -900,30 +641,22 @@ class cust_normals_applyvertsplit(bpy.types.Operator):
 	def execute(self, context):
 		mesh = context.active_object.data
 		
-		normslist = []
-		for v in mesh.vertices:
-			normslist.append(v.normal.copy())
-		
-		newnormslist = tuple(tuple(v) for v in normslist)
-		
-		for e in mesh.edges:
-			if e.use_edge_sharp:
-				e.use_edge_sharp = False
+		vertnormals = read_attribute(mesh.vertices, 'normal', np.float32, 3)
 		
 		mesh.create_normals_split()
-		mesh.polygons.foreach_set("use_smooth", [True] * len(mesh.polygons))
-		mesh.validate(clean_customdata=False)
+		mesh.polygons.foreach_set('use_smooth', np.ones(len(mesh.polygons), dtype=bool))
+		prepare_splitwrite(mesh)
 		if not mesh.use_auto_smooth:
 			mesh.use_auto_smooth = True
 		if not mesh.show_edge_sharp:
 			mesh.show_edge_sharp = True
-		mesh.normals_split_custom_set_from_vertices(newnormslist)
+		mesh.normals_split_custom_set_from_vertices(vertnormals)
 		mesh.free_normals_split()
 		mesh.update()
 		
-		
 		return {'FINISHED'}
 
+
 # -	Split -> Vert -
 class cust_normals_clearvertsplit(bpy.types.Operator):
 	bl_idname = 'object.cust_normals_clearvertsplit'
@@ -943,67 +676,23 @@ class cust_normals_clearvertsplit(bpy.types.Operator):
 		mesh = context.active_object.data
 		
 		mesh.update()
-		mesh.calc_normals_split()
 		
-		# store old normals
-		normslist = []
-		loopnorms = [v.normal for v in mesh.loops]
-		loopcount = 0
-		for f in mesh.polygons:
-			fvns = []
-			for i in range(len(f.vertices)):
-				fvns.append(loopnorms[loopcount].copy())
-				loopcount += 1
-			normslist.append(fvns)
-		del loopnorms[:]
+		# store old normals, averaged per vertex
+		meshdata = MeshSnapshot(mesh, split=True)
+		vertnormals = vertex_loopnormals(meshdata)
 		
 		# clear old normals
-		emptynormslist = tuple(tuple((0,0,0)) for v in mesh.vertices)
-		for e in mesh.edges:
-			if e.use_edge_sharp:
-				e.use_edge_sharp = False
-		
-		mesh.validate(clean_customdata=False)
+		prepare_splitwrite(mesh, topology=meshdata.geometry.topology)
 		if mesh.use_auto_smooth:
 			mesh.use_auto_smooth = False
 		if mesh.show_edge_sharp:
 			mesh.show_edge_sharp = False
-		mesh.normals_split_custom_set_from_vertices(emptynormslist)
+		mesh.normals_split_custom_set_from_vertices(np.zeros((meshdata.numverts, 3), dtype=np.float32))
 		mesh.free_normals_split()
 		mesh.update()
 		
-		# gather old split normals
-		rawnormslist = [[] for v in mesh.vertices]
-		
-		faceslist = [f for f in mesh.polygons]
-		fcount = 0
-		for f in faceslist:
-			newfn = []
-			vcount = 0
-			for v in f.vertices:
-				rawnormslist[v].append(normslist[fcount][vcount])
-				vcount += 1
-			fcount += 1
-		
-		# average split normals for new list
-		procnormslist = []
-		for vl in rawnormslist:
-			tempv = Vector((0.0,0.0,0.0))
-			for v in vl:
-				tempv = tempv + v
-			tempv = tempv.normalized()
-			procnormslist.append(tempv)
-		
-		vertslist = [v for v in mesh.vertices]
-		vcount = 0
-		for v in vertslist:
-			v.normal = procnormslist[vcount]
-			vcount += 1
-		
-		del rawnormslist[:]
-		del procnormslist[:]
-		del faceslist[:]
-		del vertslist[:]
+		# apply averaged split normals as vertex normals
+		write_vertnormals(mesh, vertnormals.reshape(-1))
 		
 		return {'FINISHED'}
 
@@ -1124,77 +813,20 @@ class cust_normals_manualset(bpy.types.Operator):
 		
 		objdata = context.active_object.data
 		
-		if context.active_object.data.use_auto_smooth:
-			tempdata = []
-			tempnormals = []
-			
-			objdata.calc_normals_split()
-			
-			vertslist = [[(v.co).copy(), v.select] for v in objdata.vertices]
-			loopnorms_raw = [(l.normal).copy() for l in objdata.loops]
-			
-			loopcount = 0
-			
-			for f in objdata.polygons:
-				fvn = []
-				fvco = []
-				fvsel = []
-				
-				for v in f.vertices:
-					fvco.append(vertslist[v][0].copy())
-					fvn.append(loopnorms_raw[loopcount].copy())
-					
-					if showselected:
-						if selectByFace:
-							fvsel.append(f.select)
-						else:
-							fvsel.append(vertslist[v][1])
-					else:
-						fvsel.append(True)
-					loopcount += 1
-				
-				tempdata.append([fvco,fvn,fvsel])
-				tempnormals.append(fvn)
-			
-			objdata.free_normals_split()
-			
-			del vertslist[:]
-			del loopnorms_raw[:]
-			
-			if len(tempdata) > 0:
-				fcount = 0
-				for f in tempdata:
-					for i in range(len(f[0])):
-						if f[2][i]:
-							if editarrow:
-								tempnormals[fcount][i] = CalcArrowNormDirection(context)
-							else:
-								tempnormals[fcount][i] = tempnorm
-					fcount += 1
-				
-				if (update_customnormals(objdata, tempnormals)):
-					context.area.tag_redraw()
-					context.scene.update()
-			
-			del tempdata[:]
-			del tempnormals[:]
-			
-		else:
-			bm = bmesh.new()
-			bm.from_mesh(objdata)
-			
-			sourceverts = [v for v in bm.verts]
-			if len(sourceverts) > 0:
-				for v in sourceverts:
-					if v.select:
-						if editarrow:
-							v.normal = CalcArrowNormDirection(context)	
-						else:
-							v.normal = tempnorm
-				
-				bm.to_mesh(objdata)
+		meshdata = MeshSnapshot(objdata)
+		# vertex normals always use the vertex selection
+		elems = meshdata.elem_indices(showselected or not meshdata.split, selectByFace)
+		if elems is None:
+			elems = np.arange(meshdata.numelems, dtype=np.int32)
+		
+		if meshdata.numelems > 0:
+			tempnormals = meshdata.normals
+			if editarrow:
+				tempnormals[elems] = CalcArrowNormDirection(context)
+			else:
+				tempnormals[elems] = tempnorm
 			
-			del sourceverts[:]
+			update_customnormals(objdata, tempnormals, topology=meshdata.geometry.topology)
 		
 		context.area.tag_redraw()
 		context.scene.update()
@@ -1232,63 +864,17 @@ class cust_normals_manualget(bpy.types.Operator):
 		
 		objdata = context.active_object.data
 		
-		if context.active_object.data.use_auto_smooth:
-			tempdata = []
-			
-			objdata.calc_normals_split()
-			
-			vertslist = [[(v.co).copy(), v.select] for v in objdata.vertices]
-			loopnorms_raw = [(l.normal).copy() for l in objdata.loops]
-			
-			loopcount = 0
-			
-			for f in objdata.polygons:
-				fvn = []
-				fvco = []
-				fvsel = []
-				
-				for v in f.vertices:
-					fvco.append(vertslist[v][0].copy())
-					fvn.append(loopnorms_raw[loopcount].copy())
-					
-					if showselected:
-						if selectByFace:
-							fvsel.append(f.select)
-						else:
-							fvsel.append(vertslist[v][1])
-					else:
-						fvsel.append(True)
-					loopcount += 1
-				
-				tempdata.append([fvco,fvn,fvsel])
-			
-			objdata.free_normals_split()
-			
-			del vertslist[:]
-			del loopnorms_raw[:]
-			
-			if len(tempdata) > 0:
-				for f in tempdata:
-					for i in range(len(f[0])):
-						if f[2][i]:
-							if editarrow:
-								arrowobj.rotation_quaternion = (f[1][i]).to_track_quat('Z','Y')
-							context.window_manager.vn_dirvector = (f[1][i]).copy()
-							break
-			del tempdata[:]
-			
-		else:
-			sourceverts = [v for v in objdata.vertices]
-			
-			if len(sourceverts) > 0:
-				for v in sourceverts:
-					if v.select:
-						if editarrow:
-							arrowobj.rotation_quaternion = (v.normal).to_track_quat('Z','Y')
-						context.window_manager.vn_dirvector = (v.normal).copy()
-						break
-			
-			del sourceverts[:]
+		meshdata = MeshSnapshot(objdata)
+		# vertex normals always use the vertex selection
+		selected = meshdata.elem_indices(showselected or not meshdata.split, selectByFace)
+		if selected is None:
+			selected = np.arange(meshdata.numelems, dtype=np.int32)
+		
+		if len(selected) > 0:
+			selnormal = Vector(meshdata.normals[selected[0]])
+			if editarrow:
+				arrowobj.rotation_quaternion = selnormal.to_track_quat('Z','Y')
+			context.window_manager.vn_dirvector = selnormal
 		
 		context.area.tag_redraw()
 		context.scene.update()
@@ -1303,6 +889,150 @@ class cust_normals_manualget(bpy.types.Operator):
 ###############################################################################
 # Transfer
 
+# source normals for each destination element, found within maxdist
+# - sources: snapshots of the source meshes, searched as one merged point set
+#   or surface, so results are the nearest across all sources
+# - source vertices are single points with the normals of their corners, the
+#   corner normal closest to the destination orientation is used (hard edges)
+# - mode: 'NEAREST' copies the nearest source vertex' normal, 'INVDIST' and
+#   'GAUSSIAN' blend the knn nearest (see knn_normals), 'SURFACE' interpolates
+#   at the closest point on the source surface (see surface_normals)
+# - destorient: destination face (split) or vertex normal per element
+# - keeps the destination normal where nothing is in range
+# - destinverse: destnorms row -> destco row, if elements share positions
+#   (split normals are queried once per vertex)
+def find_source_normals(destco, destnorms, destorient, sources, maxdist,
+		destinverse=None, mode='NEAREST', knn=1):
+	sourcenormals = destnorms.copy()
+	
+	if mode == 'SURFACE':
+		if BVHTree is not None:
+			index = surface_index([sourcedata.geometry for sourcedata in sources])
+			tags, polys, locations = index.closest(destco, maxdist)
+			if destinverse is not None:
+				tags = tags[destinverse]
+				polys = polys[destinverse]
+				locations = locations[destinverse]
+			
+			for i, sourcedata in enumerate(sources):
+				rows = np.flatnonzero(tags == i)
+				sourcenormals[rows] = surface_normals(sourcedata, polys[rows], locations[rows])
+			return sourcenormals
+		
+		print('Surface transfer needs Blender 2.76 or newer, using nearest')
+		mode = 'NEAREST'
+	
+	sourceco, offsets, normalsets = merged_normalsets(sources)
+	index = build_index(sourceco, maxdist)
+	if mode == 'NEAREST':
+		indices, dists = index.nearest(destco, maxdist)
+	else:
+		indices, dists = index.knearest(destco, knn, maxdist)
+	if destinverse is not None:
+		indices = indices[destinverse]
+		dists = dists[destinverse]
+	
+	if mode == 'NEAREST':
+		found = indices >= 0
+		sourcenormals[found] = pick_normals(indices[found], offsets, normalsets, destorient[found])
+	else:
+		blended, found = knn_normals(indices, dists, offsets, normalsets, destorient, mode)
+		sourcenormals[found] = blended[found]
+	return sourcenormals
+
+
+# shared by both transfer operators, split: destination uses split normals
+# - all selected meshes are searched at once, 'Average Sources' transfers from
+#   each one separately and averages the results (like older versions)
+def transfer_normals(context, split):
+	influenceamount = abs(context.window_manager.vn_bendingratio)
+	showselected = context.window_manager.vn_editselection
+	selectByFace = context.window_manager.vn_editbyface
+	
+	maxdist = context.window_manager.normtrans_maxdist
+	transmode = context.window_manager.normtrans_mode
+	knn = context.window_manager.normtrans_knn
+	influencemult = 1.0 if (
+		context.window_manager.vn_bendingratio > 0.0
+	) else -1.0
+	
+	if maxdist <= 0.0:
+		maxdist = 8192.0
+	if influenceamount > 0.0:
+		destobj = context.active_object.data
+		
+		destdata = MeshSnapshot(destobj, split=split)
+		destnorms = destdata.normals
+		destsel = destdata.elem_indices(showselected, selectByFace)
+		if destsel is None:
+			destsel = np.arange(destdata.numelems, dtype=np.int32)
+		
+		if split:
+			# one query per destination vertex, scattered back to its loops
+			destverts, destinverse = np.unique(destdata.loop_vert[destsel], return_inverse=True)
+			destco = destdata.co[destverts]
+			destorient = flat_normals(destdata, destsel)
+		else:
+			destinverse = None
+			destco = destdata.co[destsel]
+			destorient = weighted_normals(destdata, 'ANGLE', elems=destsel)
+		
+		sources = [
+			MeshSnapshot(obj.data) for obj in context.selected_objects
+			if obj.type == 'MESH' and obj.data != destobj
+		]
+		
+		if len(sources) > 0:
+			if context.window_manager.normtrans_average:
+				sourcegroups = [[sourcedata] for sourcedata in sources]
+			else:
+				sourcegroups = [sources]
+			
+			newnormals = np.zeros((destdata.numelems, 3), dtype=np.float32)
+			for sourcegroup in sourcegroups:
+				nearest = find_source_normals(
+					destco, destnorms[destsel], destorient, sourcegroup, maxdist,
+					destinverse, transmode, knn
+				)
+				tempnorms = destnorms.copy()
+				tempnorms[destsel] = normalize_rows(
+					((destnorms[destsel] * (1.0 - influenceamount))
+					+ (nearest * influenceamount))
+					* influencemult
+				)
+				newnormals += tempnorms
+			
+			# average influences
+			if (update_customnormals(destobj, normalize_rows(newnormals),
+					topology=destdata.geometry.topology)):
+				context.area.tag_redraw()
+				context.scene.update()
+		else:
+			print('Need more than one object')
+		
+	else:
+		print('No influence')
+	
+	return {'FINISHED'}
+
+
+# redo panel of the transfer operators
+def draw_transfer(layout, context):
+	layout.row().prop(context.window_manager,
+		'vn_bendingratio', text='Ratio')
+	layout.row().prop(context.window_manager,
+		'normtrans_maxdist', text='Distance')
+	layout.row().prop(context.window_manager,
+		'normtrans_mode', text='')
+	if context.window_manager.normtrans_mode in {'INVDIST', 'GAUSSIAN'}:
+		layout.row().prop(context.window_manager,
+			'normtrans_knn', text='Neighbors')
+	layout.row().prop(context.window_manager,
+		'normtrans_average', text='Average Sources')
+	layout.column().prop(context.window_manager,
+		'vn_editselection', text='Selected Only')
+
+
 #######################
 # Transfer Normals - vertex normals destination
 class cust_normals_transfer_tovert(bpy.types.Operator):
@@ -1319,178 +1049,10 @@ class cust_normals_transfer_tovert(bpy.types.Operator):
 		return False
 	
 	def execute(self, context):
-		influenceamount = abs(context.window_manager.vn_bendingratio)
-		showselected = context.window_manager.vn_editselection
-		selectByFace = context.window_manager.vn_editbyface
-		
-		maxdist = context.window_manager.normtrans_maxdist
-		influencemult = 1.0 if (
-			context.window_manager.vn_bendingratio > 0.0
-		) else -1.0
-		
-		if maxdist <= 0.0:
-			maxdist = 8192.0
-		if influenceamount > 0.0:
-			destobj = context.active_object.data
-			
-			destdata = [[],[],[]]
-			
-			for v in destobj.vertices:
-				destdata[0].append((v.co).copy())
-				destdata[1].append((v.normal).copy())
-				if showselected:
-					destdata[2].append(v.select)
-				else:
-					destdata[2].append(True)
-			
-			newnormals = [[] for v in destdata[1]]
-			selobjects = [obj.data for obj in context.selected_objects if obj.type == 'MESH']
-			
-			sourceverts = []
-			foundobj = (len(selobjects) > 1)
-			
-			for objmesh in selobjects:
-				if objmesh != destobj:
-					if objmesh.use_auto_smooth:
-						sourceverts = []
-						
-						objmesh.calc_normals_split()
-			
-						vertslist = [[(v.co).copy(), v.select] for v in objmesh.vertices]
-						loopnorms_raw = [(l.normal).copy() for l in objmesh.loops]
-						
-						loopcount = 0
-						
-						for f in objmesh.polygons:
-							fvn = []
-							fvco = []
-							fvsel = []
-							
-							for v in f.vertices:
-								fvco.append(vertslist[v][0].copy())
-								fvn.append(loopnorms_raw[loopcount].copy())
-								
-								if showselected:
-									if selectByFace:
-										fvsel.append(f.select)
-									else:
-										fvsel.append(vertslist[v][1])
-								else:
-									fvsel.append(True)
-								loopcount += 1
-							
-							sourceverts.append([fvco,fvn,fvsel])
-						
-						objmesh.free_normals_split()
-						
-						del vertslist[:]
-						del loopnorms_raw[:]
-						
-						
-						if len(sourceverts) > 0:
-							vcount = 0
-							for j in range(len(destdata[0])):
-								nearest = (destdata[1][j]).copy()
-								lastdist = maxdist
-								if destdata[2][j]:
-									for f in sourceverts:
-										for i in range(len(f[0])):
-											curdistv = destdata[0][j] - f[0][i]
-											curdist = curdistv.magnitude
-											
-											if curdist < maxdist:
-												if curdist < lastdist:
-													nearest = (f[1][i]).copy()
-													lastdist = curdist
-									
-									tempv = (
-										((destdata[1][j] * (1.0 - influenceamount)) 
-										+ (nearest * influenceamount))
-										* influencemult
-									).normalized()
-									newnormals[vcount].append(tempv)
-								else:
-									newnormals[vcount].append((destdata[1][j]).copy())
-								
-								vcount += 1
-							
-							del sourceverts[:]
-					else:
-						sourceverts = [[],[],[]]
-			
-						for v in objmesh.vertices:
-							sourceverts[0].append((v.co).copy())
-							sourceverts[1].append((v.normal).copy())
-							if showselected:
-								sourceverts[2].append(v.select)
-							else:
-								sourceverts[2].append(True)
-						
-						if len(sourceverts) > 0:
-							vcount = 0
-							for j in range(len(destdata[0])):
-								nearest = (destdata[1][j]).copy()
-								lastdist = maxdist
-								if destdata[2][j]:
-									for i in range(len(sourceverts[0])):
-										curdistv = destdata[0][j] - sourceverts[0][i]
-										curdist = curdistv.magnitude
-										
-										if curdist < maxdist:
-											if curdist < lastdist:
-												nearest = (sourceverts[1][i]).copy()
-												lastdist = curdist
-									
-									tempv = (
-										((destdata[1][j] * (1.0 - influenceamount)) 
-										+ (nearest * influenceamount))
-										* influencemult
-									).normalized()
-									newnormals[vcount].append(tempv)
-								else:
-									newnormals[vcount].append((destdata[1][j]).copy())
-								
-								vcount += 1
-							
-							del sourceverts[:]
-			
-			del destdata[:]
-			
-			del selobjects[:]
-			
-			if foundobj:
-				# average influences
-				procnormslist = []
-				for vl in newnormals:
-					tempv = Vector((0.0,0.0,0.0))
-					if len(vl) > 0:
-						for v in vl:
-							tempv = tempv + v
-						procnormslist.append(tempv.normalized())
-				
-				if (update_customnormals(destobj, procnormslist)):
-					context.area.tag_redraw()
-					context.scene.update()
-				
-				del procnormslist[:]
-			else:
-				print('Need more than one object')
-				
-			del newnormals[:]
-			
-		else:
-			print('No influence')
-		
-		return {'FINISHED'}
+		return transfer_normals(context, False)
 	
 	def draw(self, context):
-		layout = self.layout
-		layout.row().prop(context.window_manager,
-			'vn_bendingratio', text='Ratio')
-		layout.row().prop(context.window_manager,
-			'normtrans_maxdist', text='Distance')
-		layout.column().prop(context.window_manager,
-			'vn_editselection', text='Selected Only')
+		draw_transfer(self.layout, context)
 
 
 #######################
@@ -1509,216 +1071,7 @@ class cust_normals_transfer_topoly(bpy.types.Operator):
 		return False
 	
 	def execute(self, context):
-		influenceamount = abs(context.window_manager.vn_bendingratio)
-		showselected = context.window_manager.vn_editselection
-		selectByFace = context.window_manager.vn_editbyface
-		
-		maxdist = context.window_manager.normtrans_maxdist
-		influencemult = 1.0 if (
-			context.window_manager.vn_bendingratio > 0.0
-		) else -1.0
-		
-		selectByFace = context.window_manager.vn_editbyface
-		editselection = context.window_manager.vn_editselection
-		
-		if maxdist <= 0.0:
-			maxdist = 8192.0
-		if influenceamount > 0.0:
-			destobj = context.active_object.data
-			destdata = []
-			newnormals = []
-			
-			destobj.calc_normals_split()
-			
-			vertslist = [[(v.co).copy(), v.select] for v in destobj.vertices]
-			loopnorms_raw = [(l.normal).copy() for l in destobj.loops]
-			
-			loopcount = 0
-			dfcount = 0
-			for f in destobj.polygons:
-				fvn = []
-				fvco = []
-				fvsel = []
-				newnormals.append([])
-				
-				for v in f.vertices:
-					fvco.append(vertslist[v][0].copy())
-					fvn.append(loopnorms_raw[loopcount].copy())
-					
-					if showselected:
-						if selectByFace:
-							fvsel.append(f.select)
-						else:
-							fvsel.append(vertslist[v][1])
-					else:
-						fvsel.append(True)
-					loopcount += 1
-					
-					newnormals[dfcount].append([])
-				
-				destdata.append([fvco,fvn,fvsel])
-				
-				dfcount += 1
-			
-			destobj.free_normals_split()
-			
-			del vertslist[:]
-			del loopnorms_raw[:]
-			
-			selobjects = [obj.data for obj in context.selected_objects if obj.type == 'MESH']
-			sourceverts = []
-			
-			foundobj = (len(selobjects) > 1)
-			
-			for objmesh in selobjects:
-				if objmesh != destobj:
-					fcount = 0
-					lastdist = maxdist
-					curdistv = Vector((0.0,0.0,0.0))
-					tempv = Vector((0.0,0.0,0.0))
-					curdist = 0.0
-					
-					if objmesh.use_auto_smooth:
-						sourceverts = []
-						
-						objmesh.calc_normals_split()
-						
-						vertslist = [[(v.co).copy(), v.select] for v in objmesh.vertices]
-						loopnorms_raw = [(l.normal).copy() for l in objmesh.loops]
-						
-						loopcount = 0
-						
-						for f in objmesh.polygons:
-							fvn = []
-							fvco = []
-							fvsel = []
-							
-							for v in f.vertices:
-								fvco.append(vertslist[v][0].copy())
-								fvn.append(loopnorms_raw[loopcount].copy())
-								
-								if showselected:
-									if selectByFace:
-										fvsel.append(f.select)
-									else:
-										fvsel.append(vertslist[v][1])
-								else:
-									fvsel.append(True)
-								loopcount += 1
-							
-							sourceverts.append([fvco,fvn,fvsel])
-						
-						objmesh.free_normals_split()
-						
-						del vertslist[:]
-						del loopnorms_raw[:]
-						
-						if len(sourceverts) > 0:
-							for f in destdata:
-								for i in range(len(f[0])):
-									lastdist = maxdist
-									nearest = f[1][i].copy()
-									
-									if f[2][i]:
-										for df in sourceverts:
-											for j in range(len(df[0])):
-												curdistv = f[0][i] - df[0][j]
-												curdist = curdistv.magnitude
-												if curdist < maxdist:
-													if curdist < lastdist:
-														nearest = df[1][j].copy()
-														lastdist = curdist
-										
-										tempv = (
-											((f[1][i] * (1.0 - influenceamount)) 
-											+ (nearest * influenceamount))
-											* influencemult
-										).normalized()
-										newnormals[fcount][i].append(tempv.copy())
-									
-									else:
-										newnormals[fcount][i].append(f[1][i].copy())
-								
-								fcount += 1
-							
-							del sourceverts[:]
-					else:
-						sourceverts = [[],[],[]]
-			
-						for v in objmesh.vertices:
-							sourceverts[0].append((v.co).copy())
-							sourceverts[1].append((v.normal).copy())
-							if showselected:
-								sourceverts[2].append(v.select)
-							else:
-								sourceverts[2].append(True)
-						
-						if len(sourceverts) > 0:
-							
-							for f in destdata:
-								for i in range(len(f[0])):
-									lastdist = maxdist
-									nearest = f[1][i].copy()
-									
-									if f[2][i]:
-										for j in range(len(sourceverts[0])):
-											curdistv = f[0][i] - sourceverts[0][j]
-											curdist = curdistv.magnitude
-											if curdist < maxdist:
-												if curdist < lastdist:
-													nearest = sourceverts[1][j].copy()
-													lastdist = curdist
-										
-										tempv = (
-											((f[1][i] * (1.0 - influenceamount)) 
-											+ (nearest * influenceamount))
-											* influencemult
-										).normalized()
-										newnormals[fcount][i].append(tempv.copy())
-									
-									else:
-										newnormals[fcount][i].append(f[1][i].copy())
-								
-								fcount += 1
-							
-							del sourceverts[:]
-			
-			del destdata[:]
-			del selobjects[:]
-			
-			if foundobj:
-				procnormslist = []
-				
-				for i in range(len(newnormals)):
-					procnormslist.append([])
-					for j in range(len(newnormals[i])):
-						tempv = Vector((0.0,0.0,0.0))
-						if len(newnormals[i][j]) > 0:
-							for v in newnormals[i][j]:
-								tempv = tempv + v
-							procnormslist[i].append(tempv.normalized())
-				
-				if (update_customnormals(destobj, procnormslist)):
-					context.area.tag_redraw()
-					context.scene.update()
-				
-			else:
-				print('Need more than one object')
-			
-			del newnormals[:]
-			
-		else:
-			print('No influence')
-		
-		return {'FINISHED'}
+		return transfer_normals(context, True)
 	
 	def draw(self, context):
-		layout = self.layout
-		layout.row().prop(context.window_manager,
-			'vn_bendingratio', text='Ratio')
-		layout.row().prop(context.window_manager,
-			'normtrans_maxdist', text='Distance')
-		layout.column().prop(context.window_manager,
-			'vn_editselection', text='Selected Only')
-		
-
+		draw_transfer(self.layout, context)
@@ -0,0 +1,527 @@
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# ##### END GPL LICENSE BLOCK #####
+
+
+import numpy as np
+
+from .normeditor_meshdata import csr_rows, csr_sum, expand_ranges, normalize_rows, segment_sum
+
+
+#######################################
+# Vectorized normal generators
+#
+# - kernels take a MeshSnapshot and return new normals for the snapshot's
+#   elements (loops for split normals, vertices for vertex normals)
+# - elems: sorted element indices (MeshSnapshot.elem_indices), None for all;
+#   only those elements and their one-ring are evaluated, results are per elems row
+# - only the math is sparse: snapshots still hold full arrays, read from the
+#   mesh on every run and written back in full
+# - results are blended into the current normals with blend_normals
+
+
+# blends the elems rows of normals towards newnormals by ratio, in place
+# - newnormals has one row per elems entry (or per element if elems is None)
+# - generated normals are normalized before blending, like the old per-vector code
+def blend_normals(normals, newnormals, ratio, elems=None):
+	if elems is None:
+		elems = slice(None)
+	
+	newnormals = normalize_rows(np.array(newnormals, dtype=np.float32))
+	normals[elems] = normalize_rows((normals[elems] * (1.0 - ratio)) + (newnormals * ratio))
+	return normals
+
+
+# vertices of the given elements
+# - returns (verts, inverse): per-vertex results r[inverse] are per element
+# - verts is None for all vertices, inverse is None if elements are vertices
+def element_verts(meshdata, elems=None):
+	if elems is None:
+		return None, (meshdata.loop_vert if meshdata.split else None)
+	if meshdata.split:
+		return np.unique(meshdata.loop_vert[elems], return_inverse=True)
+	return elems, None
+
+
+def gather_elements(values, inverse):
+	if inverse is None:
+		return values
+	return values[inverse]
+
+
+#######################################
+# Weighted average of connected face normals
+#
+# - a weighting kernel returns one weight per loop (polygon corner), the
+#   face normal of each corner is added to its vertex with that weight
+# - loops: loop indices to weight, None for all loops
+# - new schemes only need a kernel and an entry in weight_kernels
+
+def weight_uniform(meshdata, loops=None):
+	return np.ones(meshdata.numloops if loops is None else len(loops), dtype=np.float32)
+
+
+def weight_area(meshdata, loops=None):
+	if loops is None:
+		return meshdata.poly_area[meshdata.loop_poly]
+	return meshdata.poly_area[meshdata.loop_poly[loops]]
+
+
+def weight_angle(meshdata, loops=None):
+	return meshdata.geometry.corners(loops)[0]
+
+
+def weight_areaangle(meshdata, loops=None):
+	return weight_area(meshdata, loops) * weight_angle(meshdata, loops)
+
+
+# inverse product of the two edge lengths at the corner
+def weight_edgelength(meshdata, loops=None):
+	lengths = meshdata.geometry.corners(loops)[1]
+	lengthprod = lengths[:, 0] * lengths[:, 1]
+	weights = np.zeros(len(lengthprod), dtype=np.float32)
+	np.divide(1.0, lengthprod, out=weights, where=(lengthprod > 0.0))
+	return weights
+
+
+# generate modes -> weighting kernels
+weight_kernels = {
+	'SMOOTH': weight_uniform,
+	'WEIGHT': weight_area,
+	'ANGLE': weight_angle,
+	'AREAANGLE': weight_areaangle,
+	'EDGELEN': weight_edgelength,
+}
+
+
+# weighted sum of connected face normals per element
+# - kernel: key of weight_kernels
+# - facemask: optional per-polygon mask of faces to include
+def weighted_normals(meshdata, kernel, facemask=None, elems=None):
+	verts, inverse = element_verts(meshdata, elems)
+	vf_offsets, vf_polys, vf_loops = meshdata.geometry.vertfaces()
+	
+	if verts is None:
+		loops = vf_loops
+		loopweights = weight_kernels[kernel](meshdata)[loops]
+	else:
+		entries, rowids = csr_rows(vf_offsets, verts)
+		loops = vf_loops[entries]
+		loopweights = weight_kernels[kernel](meshdata, loops)
+	
+	polys = meshdata.loop_poly[loops]
+	if facemask is not None:
+		loopweights = loopweights * facemask[polys]
+	facenormals = meshdata.poly_normals[polys] * loopweights[:, None]
+	
+	if verts is None:
+		vertnormals = csr_sum(vf_offsets, facenormals)
+	else:
+		vertnormals = segment_sum(rowids, facenormals, len(verts))
+	return gather_elements(vertnormals, inverse)
+
+
+#######################################
+# Smooth fans (split normals)
+#
+# - loops around a vertex are grouped into fans, connected across smooth edges
+# - fans are labelled with vectorized union-find over connected loop pairs
+# - for a subset of elements, only the loops around their vertices are labelled
+
+# labels connected components of count items, given pairs of connected items
+# - labels are the smallest item index of each component
+def union_find(count, itemsa, itemsb):
+	labels = np.arange(count, dtype=np.int32)
+	if len(itemsa) == 0:
+		return labels
+	
+	while True:
+		rootsa = labels[itemsa]
+		rootsb = labels[itemsb]
+		linked = rootsa != rootsb
+		if not linked.any():
+			return labels
+		
+		# hook the larger root onto the smaller one
+		rootsa = rootsa[linked]
+		rootsb = rootsb[linked]
+		np.minimum.at(labels, rootsa, rootsb)
+		np.minimum.at(labels, rootsb, rootsa)
+		
+		# path compression
+		parents = labels[labels]
+		while (parents != labels).any():
+			labels = parents
+			parents = labels[labels]
+
+
+# all loops around the vertices of the given loops, sorted
+def ring_loops(meshdata, loops):
+	vf_offsets, vf_polys, vf_loops = meshdata.geometry.vertfaces()
+	verts = np.unique(meshdata.loop_vert[loops])
+	return np.sort(vf_loops[csr_rows(vf_offsets, verts)[0]])
+
+
+# edges used by the given loops' corners (each corner touches two edges)
+def ring_edges(meshdata, loops):
+	loop_prev = meshdata.geometry.loopneighbors()[1]
+	return np.unique(np.concatenate(
+		(meshdata.loop_edge[loops], meshdata.loop_edge[loop_prev[loops]])))
+
+
+# edges that don't split fans: manifold, with a dihedral angle up to angle
+# - angle: in radians, None to ignore face angles
+# - returns a mask over edges, or over all edges if edges is None
+def smooth_edges(meshdata, angle=None, edges=None):
+	edge_loops, smoothedges = meshdata.geometry.edgeloops()
+	if edges is None:
+		smoothedges = smoothedges.copy()
+	else:
+		edge_loops = edge_loops[edges]
+		smoothedges = smoothedges[edges]
+	
+	if angle is not None:
+		polys = meshdata.loop_poly[edge_loops[smoothedges]]
+		facedots = (meshdata.poly_normals[polys[:, 0]] * meshdata.poly_normals[polys[:, 1]]).sum(axis=1)
+		smoothedges[smoothedges] = facedots >= np.cos(angle)
+	
+	return smoothedges
+
+
+# fan label of each loop, fans are connected across the given smooth edges (indices)
+# - loops: sorted loops to label, None for all; labels index into loops
+#   and pairs reaching outside of loops are ignored
+def loop_fans(meshdata, smoothedges, loops=None):
+	edge_loops = meshdata.geometry.edgeloops()[0][smoothedges]
+	loop_next = meshdata.geometry.loopneighbors()[0]
+	
+	# loop a runs from vertex va to vb, find the loops of face b at va and vb
+	loopsa = edge_loops[:, 0]
+	loopsb = edge_loops[:, 1]
+	samestart = meshdata.loop_vert[loopsb] == meshdata.loop_vert[loopsa]
+	loopsb_va = np.where(samestart, loopsb, loop_next[loopsb])
+	loopsb_vb = np.where(samestart, loop_next[loopsb], loopsb)
+	
+	itemsa = np.concatenate((loopsa, loop_next[loopsa]))
+	itemsb = np.concatenate((loopsb_va, loopsb_vb))
+	if loops is None:
+		return union_find(meshdata.numloops, itemsa, itemsb)
+	
+	# global -> local loop indices
+	locala = np.minimum(np.searchsorted(loops, itemsa), len(loops) - 1)
+	localb = np.minimum(np.searchsorted(loops, itemsb), len(loops) - 1)
+	inside = (loops[locala] == itemsa) & (loops[localb] == itemsb)
+	return union_find(len(loops), locala[inside], localb[inside])
+
+
+# weighted sum of the face normals of each fan, gathered to its loops
+# - loopweights: weight per loop, see weight_kernels
+# - loops: the loops fans were labelled for (see loop_fans), None for all
+def fan_normals(meshdata, fans, loopweights, loops=None):
+	polys = meshdata.loop_poly if loops is None else meshdata.loop_poly[loops]
+	facenormals = meshdata.poly_normals[polys] * loopweights[:, None]
+	return segment_sum(fans, facenormals, len(fans))[fans]
+
+
+# weighted sum of face normals per smooth fan (split normals only)
+# - fans are split at edges sharper than angle and at hardedges (per-edge mask)
+# - kernel, facemask: see weighted_normals
+def fan_weighted_normals(meshdata, kernel, angle=None, hardedges=None, facemask=None, elems=None):
+	loops = edges = None
+	if elems is not None:
+		if len(elems) == 0:
+			return np.zeros((0, 3), dtype=np.float32)
+		loops = ring_loops(meshdata, elems)
+		edges = ring_edges(meshdata, loops)
+	
+	smoothedges = smooth_edges(meshdata, angle, edges)
+	if hardedges is not None:
+		smoothedges &= ~(hardedges if edges is None else hardedges[edges])
+	smoothedges = np.flatnonzero(smoothedges) if edges is None else edges[smoothedges]
+	
+	loopweights = weight_kernels[kernel](meshdata, loops)
+	if facemask is not None:
+		polys = meshdata.loop_poly if loops is None else meshdata.loop_poly[loops]
+		loopweights = loopweights * facemask[polys]
+	
+	fans = loop_fans(meshdata, smoothedges, loops)
+	fannormals = fan_normals(meshdata, fans, loopweights, loops)
+	if loops is None:
+		return fannormals
+	return fannormals[np.searchsorted(loops, elems)]
+
+
+# - Default -
+# Blender's default normals, face normals weighted by corner angle
+# - split normals are averaged per fan, fans split at edges sharper than angle
+def default_normals(meshdata, angle=None, elems=None):
+	if not meshdata.split:
+		return weighted_normals(meshdata, 'ANGLE', elems=elems)
+	return fan_weighted_normals(meshdata, 'ANGLE', angle, elems=elems)
+
+
+# - Flat -
+# polygon normals gathered to their loops (split normals only)
+def flat_normals(meshdata, elems=None):
+	if elems is None:
+		return meshdata.poly_normals[meshdata.loop_poly]
+	return meshdata.poly_normals[meshdata.loop_poly[elems]]
+
+
+# - Bent -
+#
+# normals point away from attractors, blended by distance:
+# - attractors: list of (matrix, shape, radius)
+#   - matrix: 4x4 world matrix of the proxy shape, shapes are unit sized in its space
+#   - shape: key of proxy_shapes
+#   - radius: distance at which the attractor's influence fades out, 0 for unlimited
+# - falloff: exponent of the inverse distance weights between attractors
+# - evaluated in world space, objmatrix is the mesh object's world matrix
+
+# offsets from the closest point of each proxy shape, in the shape's space
+def proxy_point(localco):
+	return localco
+
+
+# segment from start to end along Z
+def segment_offsets(localco, start, end):
+	closest = np.zeros_like(localco)
+	closest[:, 2] = np.clip(localco[:, 2], start, end)
+	return localco - closest
+
+
+# segment from -1 to 1 along Z: capsule/cylinder axis
+def proxy_capsule(localco):
+	return segment_offsets(localco, -1.0, 1.0)
+
+
+# segment from the origin to 1 along Z, like a single arrow empty
+def proxy_arrow(localco):
+	return segment_offsets(localco, 0.0, 1.0)
+
+
+# sphere of radius 1, points inside push out radially
+# - points on the surface keep a tiny offset so they still get a direction
+def proxy_sphere(localco):
+	lengths = np.sqrt((localco * localco).sum(axis=1))
+	directions = normalize_rows(localco.copy())
+	directions[lengths == 0.0, 2] = 1.0
+	return directions * np.maximum(np.abs(lengths - 1.0), 1e-6)[:, None]
+
+
+# XZ plane (normal along Y, like a circle empty), pushes away on both sides
+def proxy_plane(localco):
+	offsets = np.zeros_like(localco)
+	offsets[:, 1] = localco[:, 1]
+	offsets[offsets[:, 1] == 0.0, 1] = 1.0
+	return offsets
+
+
+# box from -1 to 1, points inside push out through the nearest side
+def proxy_box(localco):
+	offsets = localco - np.clip(localco, -1.0, 1.0)
+	inside = ~(offsets != 0.0).any(axis=1)
+	if inside.any():
+		insideco = localco[inside]
+		axis = np.abs(insideco).argmax(axis=1)
+		rows = np.arange(len(insideco))
+		pushed = np.zeros_like(insideco)
+		pushed[rows, axis] = np.where(insideco[rows, axis] < 0.0, -1.0, 1.0)
+		offsets[inside] = pushed
+	return offsets
+
+
+proxy_shapes = {
+	'POINT': proxy_point,
+	'SPHERE': proxy_sphere,
+	'CAPSULE': proxy_capsule,
+	'ARROW': proxy_arrow,
+	'PLANE': proxy_plane,
+	'BOX': proxy_box,
+}
+
+
+# returns bent normals and a mask of elements reached by any attractor
+def bent_normals(meshdata, objmatrix, attractors, falloff=2.0, elems=None):
+	verts, inverse = element_verts(meshdata, elems)
+	co = meshdata.co if verts is None else meshdata.co[verts]
+	
+	objmatrix = np.asarray(objmatrix, dtype=np.float64)
+	worldco = np.dot(co, objmatrix[:3, :3].T) + objmatrix[:3, 3]
+	
+	directions = np.zeros((len(co), 3), dtype=np.float64)
+	weightsum = np.zeros(len(co), dtype=np.float64)
+	
+	for matrix, shape, radius in attractors:
+		matrix = np.asarray(matrix, dtype=np.float64)
+		invmatrix = np.linalg.inv(matrix)
+		localco = np.dot(worldco, invmatrix[:3, :3].T) + invmatrix[:3, 3]
+		offsets = np.dot(proxy_shapes[shape](localco), matrix[:3, :3].T)
+		
+		dists = np.sqrt((offsets * offsets).sum(axis=1))
+		weights = 1.0 / np.maximum(dists, 1e-6) ** falloff
+		if radius > 0.0:
+			weights *= np.clip(1.0 - (dists / radius), 0.0, 1.0) ** 2
+		
+		directions += normalize_rows(offsets) * weights[:, None]
+		weightsum += weights
+	
+	# world -> object space (normals transform by the transposed matrix)
+	vertnormals = normalize_rows(np.dot(directions, objmatrix[:3, :3])).astype(np.float32)
+	reached = weightsum > 0.0
+	return gather_elements(vertnormals, inverse), gather_elements(reached, inverse)
+
+
+# - Split -> Vert -
+# loop normals summed per vertex with one scatter-add, normalized
+def vertex_loopnormals(meshdata):
+	return normalize_rows(segment_sum(meshdata.loop_vert, meshdata.loop_normals, meshdata.numverts))
+
+
+#######################################
+# Transfer
+
+# picks one normal per query from the candidate normals of its source point
+# - the candidate that agrees best with the query's orientation (destination
+#   face or vertex normal), the first one on ties
+# - points: source point per query, offsets/normals: candidate normals per
+#   point as a CSR index (see merged_normalsets)
+def pick_normals(points, offsets, normals, orientations):
+	entries, rowids = csr_rows(offsets, points)
+	dots = (normals[entries] * orientations[rowids]).sum(axis=1)
+	order = np.lexsort((entries, -dots, rowids))
+	firsts = np.ones(len(order), dtype=bool)
+	firsts[1:] = rowids[order[1:]] != rowids[order[:-1]]
+	return normals[entries[order[firsts]]]
+
+
+# weighted blend of the normals of the k nearest source points of each query
+# - indices, dists: (queries, k) from a spatial index' knearest, -1 for no point
+# - weighting: 'INVDIST' (inverse squared distance) or 'GAUSSIAN' (sigma is
+#   half the distance to the farthest neighbor found for the query)
+# - offsets, normals, orientations: see pick_normals
+# returns the blended normals and a mask of queries with any neighbor
+def knn_normals(indices, dists, offsets, normals, orientations, weighting):
+	found = indices >= 0
+	rows, cols = np.nonzero(found)
+	neighbornormals = pick_normals(indices[rows, cols], offsets, normals, orientations[rows])
+	neighbordists = dists[rows, cols]
+	
+	if weighting == 'GAUSSIAN':
+		sigma = np.where(found, dists, 0.0).max(axis=1)[rows] * 0.5
+		weights = np.ones(len(rows), dtype=np.float64)
+		spread = sigma > 0.0
+		weights[spread] = np.exp(-0.5 * (neighbordists[spread] / sigma[spread]) ** 2)
+	else:
+		weights = 1.0 / np.maximum(neighbordists, 1e-6) ** 2
+	
+	blended = segment_sum(rows, neighbornormals * weights[:, None], len(indices))
+	return normalize_rows(blended.astype(np.float32)), found.any(axis=1)
+
+
+# barycentric coordinates of points in triangles (n, 3 corners, 3)
+# - points are projected onto the triangle planes, degenerate triangles use the first corner
+def barycentric(triangles, points):
+	edge1 = triangles[:, 1] - triangles[:, 0]
+	edge2 = triangles[:, 2] - triangles[:, 0]
+	offsets = points - triangles[:, 0]
+	d11 = (edge1 * edge1).sum(axis=1)
+	d12 = (edge1 * edge2).sum(axis=1)
+	d22 = (edge2 * edge2).sum(axis=1)
+	d1p = (edge1 * offsets).sum(axis=1)
+	d2p = (edge2 * offsets).sum(axis=1)
+	denom = d11 * d22 - d12 * d12
+	
+	coords = np.zeros((len(points), 3), dtype=np.float64)
+	valid = denom != 0.0
+	coords[valid, 1] = (d22 * d1p - d12 * d2p)[valid] / denom[valid]
+	coords[valid, 2] = (d11 * d2p - d12 * d1p)[valid] / denom[valid]
+	coords[:, 0] = 1.0 - coords[:, 1] - coords[:, 2]
+	return coords
+
+
+# normals interpolated at points on the snapshot's polygons
+# - polys: polygon of each point, locations: the points (closest surface points)
+# - polygons are fan triangulated, the triangle the point lies in is used
+#   and the normals of its corners (split or vertex normals) are interpolated
+def surface_normals(meshdata, polys, locations):
+	loopstart = meshdata.poly_loopstart[polys]
+	entries, rowids = expand_ranges(loopstart + 1, meshdata.poly_looptotal[polys] - 2)
+	corners = np.stack((loopstart[rowids], entries, entries + 1), axis=1)
+	
+	coords = barycentric(meshdata.co[meshdata.loop_vert[corners]].astype(np.float64), locations[rowids])
+	
+	# triangle of each point: the one it is furthest inside of
+	order = np.lexsort((-coords.min(axis=1), rowids))
+	firsts = np.ones(len(order), dtype=bool)
+	firsts[1:] = rowids[order[1:]] != rowids[order[:-1]]
+	best = order[firsts]
+	
+	weights = np.clip(coords[best], 0.0, None)
+	weights /= np.maximum(weights.sum(axis=1), 1e-12)[:, None]
+	if meshdata.split:
+		cornernormals = meshdata.loop_normals[corners[best]]
+	else:
+		cornernormals = meshdata.vert_normals[meshdata.loop_vert[corners[best]]]
+	
+	return normalize_rows((cornernormals * weights[:, :, None]).sum(axis=1).astype(np.float32))
+
+
+#######################################
+# In-place transforms of the current normals
+#
+# - each applies one 3x3 matrix (or a per-row reflection) to the elems rows
+
+# applies matrix to the elems rows of normals
+def transform_normals(normals, matrix, elems=None):
+	if elems is None:
+		elems = slice(None)
+	normals[elems] = normalize_rows(np.dot(normals[elems], np.asarray(matrix, dtype=np.float32).T))
+	return normals
+
+
+# rotation matrix of a (w, x, y, z) quaternion
+# - a zero-length quaternion is treated as no rotation
+def quaternion_matrix(quat):
+	quat = np.asarray(quat, dtype=np.float64)
+	length = np.sqrt(np.dot(quat, quat))
+	if length == 0.0:
+		return np.identity(3)
+	w, x, y, z = quat / length
+	return np.array((
+		(1.0 - 2.0 * (y * y + z * z), 2.0 * (x * y - z * w), 2.0 * (x * z + y * w)),
+		(2.0 * (x * y + z * w), 1.0 - 2.0 * (x * x + z * z), 2.0 * (y * z - x * w)),
+		(2.0 * (x * z - y * w), 2.0 * (y * z + x * w), 1.0 - 2.0 * (x * x + y * y))
+	))
+
+
+# reflection across the plane through the origin perpendicular to axis (0: X, 1: Y, 2: Z)
+def mirror_matrix(axis):
+	matrix = np.identity(3)
+	matrix[axis, axis] = -1.0
+	return matrix
+
+
+# reflects the elems rows about the tangent planes given by surfacenormals
+# - surfacenormals has one row per elems entry
+def reflect_normals(normals, surfacenormals, elems=None):
+	if elems is None:
+		elems = slice(None)
+	surface = normalize_rows(np.array(surfacenormals, dtype=np.float32))
+	offsets = (normals[elems] * surface).sum(axis=1)
+	normals[elems] -= (2.0 * offsets)[:, None] * surface
+	return normals
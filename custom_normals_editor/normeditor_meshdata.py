@@ -0,0 +1,511 @@
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# ##### END GPL LICENSE BLOCK #####
+
+import bpy
+from collections import OrderedDict
+import numpy as np
+import weakref
+import zlib
+
+
+# reads one attribute of a mesh collection (vertices, loops, ...) in bulk
+# returns a flat array, or (count, width) for vector attributes
+def read_attribute(collection, attr, dtype, width=1):
+	data = np.empty(len(collection) * width, dtype=dtype)
+	if len(data) > 0:
+		collection.foreach_get(attr, data)
+	if width > 1:
+		return data.reshape(-1, width)
+	return data
+
+
+# loads the edit mesh into the mesh's arrays if mesh is being edited
+# - bulk reads (foreach_get) only see edit mode changes after this
+def sync_editmode(mesh):
+	if mesh.is_editmode:
+		editobj = bpy.context.edit_object
+		if editobj is not None and editobj.data == mesh:
+			editobj.update_from_editmode()
+
+
+# cheap fingerprint of a mesh's structure: element counts + connectivity checksums
+def topology_fingerprint(mesh):
+	loopverts = read_attribute(mesh.loops, 'vertex_index', np.int32)
+	polytotals = read_attribute(mesh.polygons, 'loop_total', np.int32)
+	edgeverts = read_attribute(mesh.edges, 'vertices', np.int32, 2)
+	
+	return (
+		len(mesh.vertices), len(mesh.edges), len(mesh.loops), len(mesh.polygons),
+		zlib.crc32(loopverts), zlib.crc32(polytotals), zlib.crc32(edgeverts)
+	)
+
+
+# normalizes the rows of an (n, 3) array in place, zero-length rows stay zero
+def normalize_rows(vecs):
+	lengths = np.sqrt((vecs * vecs).sum(axis=1))
+	lengths[lengths == 0.0] = 1.0
+	vecs /= lengths[:, None]
+	return vecs
+
+
+# sums the values of each row of a compressed sparse row index
+# - values has one entry per index entry, empty rows sum to zero
+def csr_sum(offsets, values):
+	sums = np.zeros((len(offsets) - 1,) + values.shape[1:], dtype=values.dtype)
+	nonempty = offsets[1:] > offsets[:-1]
+	if len(values) > 0:
+		sums[nonempty] = np.add.reduceat(values, offsets[:-1][nonempty], axis=0)
+	return sums
+
+
+# entries of the ranges start:start + count, concatenated
+# - returns (entries, rowids), rowids is the range of each entry
+def expand_ranges(starts, counts):
+	rowids = np.repeat(np.arange(len(starts), dtype=np.int32), counts)
+	ends = np.cumsum(counts)
+	total = ends[-1] if len(ends) > 0 else 0
+	entries = np.arange(total, dtype=np.int32) + np.repeat(starts - (ends - counts), counts)
+	return entries.astype(np.int32), rowids
+
+
+# entries of some rows of a compressed sparse row index, see expand_ranges
+def csr_rows(offsets, rows):
+	return expand_ranges(offsets[rows], offsets[rows + 1] - offsets[rows])
+
+
+# sums (n, width) values into count rows by rowids, empty rows sum to zero
+def segment_sum(rowids, values, count):
+	sums = np.empty((count, values.shape[1]), dtype=values.dtype)
+	for i in range(values.shape[1]):
+		sums[:, i] = np.bincount(rowids, weights=values[:, i], minlength=count)
+	return sums
+
+
+#######################################
+# Mesh topology, cached across operator invocations
+#
+# - everything that only depends on connectivity, so it survives moving vertices
+# - arrays are shared between geometries and snapshots and must not be modified
+class MeshTopology:
+	def __init__(self, mesh):
+		self.numverts = len(mesh.vertices)
+		self.numloops = len(mesh.loops)
+		self.numpolys = len(mesh.polygons)
+		self.numedges = len(mesh.edges)
+		
+		# polygons
+		self.poly_loopstart = read_attribute(mesh.polygons, 'loop_start', np.int32)
+		self.poly_looptotal = read_attribute(mesh.polygons, 'loop_total', np.int32)
+		
+		# loops
+		self.loop_vert = read_attribute(mesh.loops, 'vertex_index', np.int32)
+		self.loop_edge = read_attribute(mesh.loops, 'edge_index', np.int32)
+		self.loop_poly = np.repeat(
+			np.arange(self.numpolys, dtype=np.int32), self.poly_looptotal)
+		
+		# adjacency, built on first use
+		self.vf_offsets = None
+		self.vf_loops = None
+		self.vf_polys = None
+		self.loop_next = None
+		self.loop_prev = None
+		self.edge_loops = None
+		self.edge_manifold = None
+		
+		# set once mesh.validate() found nothing to fix, split writes skip it then
+		self.validated = False
+		
+		# weak reference to the geometry currently using this topology, told
+		# about size changes (weak, so evicted geometries are freed right away)
+		self.owner = None
+		
+		self.freeze()
+	
+	# edge -> the two loops using it, for manifold edges
+	# - edge_loops is (edges, 2), rows of other edges are -1
+	# - each loop runs along its edge, from its vertex to the next loop's vertex
+	def edgeloops(self):
+		if self.edge_loops is None:
+			counts = np.bincount(self.loop_edge, minlength=self.numedges)
+			order = np.argsort(self.loop_edge, kind='mergesort').astype(np.int32)
+			starts = np.zeros(self.numedges, dtype=np.int32)
+			np.cumsum(counts[:-1], out=starts[1:])
+			
+			self.edge_manifold = (counts == 2)
+			self.edge_loops = np.full((self.numedges, 2), -1, dtype=np.int32)
+			self.edge_loops[self.edge_manifold, 0] = order[starts[self.edge_manifold]]
+			self.edge_loops[self.edge_manifold, 1] = order[starts[self.edge_manifold] + 1]
+			self.freeze()
+		
+		return self.edge_loops, self.edge_manifold
+	
+	# next/previous loop of each loop within its polygon
+	def loopneighbors(self):
+		if self.loop_next is None:
+			loopstart = self.poly_loopstart[self.loop_poly]
+			looptotal = self.poly_looptotal[self.loop_poly]
+			offset = np.arange(self.numloops, dtype=np.int32) - loopstart
+			self.loop_next = loopstart + (offset + 1) % looptotal
+			self.loop_prev = loopstart + (offset - 1) % looptotal
+			self.freeze()
+		
+		return self.loop_next, self.loop_prev
+	
+	# vertex -> incident polygons as a compressed sparse row index
+	# - entries of vertex v are vf_offsets[v]:vf_offsets[v + 1]
+	# - vf_polys holds the polygon of each entry, vf_loops the matching loop
+	def vertfaces(self):
+		if self.vf_offsets is None:
+			counts = np.bincount(self.loop_vert, minlength=self.numverts)
+			self.vf_offsets = np.zeros(self.numverts + 1, dtype=np.int32)
+			np.cumsum(counts, out=self.vf_offsets[1:])
+			self.vf_loops = np.argsort(self.loop_vert, kind='mergesort').astype(np.int32)
+			self.vf_polys = self.loop_poly[self.vf_loops]
+			self.freeze()
+		
+		return self.vf_offsets, self.vf_polys, self.vf_loops
+	
+	# makes all arrays read-only
+	# - called after building data on demand, updates the owner's cache entry
+	def freeze(self):
+		for v in vars(self).values():
+			if isinstance(v, np.ndarray):
+				v.flags.writeable = False
+		
+		owner = self.owner() if self.owner is not None else None
+		if owner is not None:
+			owner.freeze()
+	
+	# memory used by all arrays
+	def nbytes(self):
+		return sum(v.nbytes for v in vars(self).values() if isinstance(v, np.ndarray))
+
+
+#######################################
+# Mesh geometry, cached across operator invocations
+#
+# - everything that depends on coordinates, topology comes from MeshTopology
+# - topology is reused when only coordinates changed
+# - arrays are shared between snapshots and must not be modified
+class MeshGeometry:
+	def __init__(self, mesh, co=None, topology=None):
+		if topology is None:
+			topology = MeshTopology(mesh)
+		self.topology = topology
+		topology.owner = weakref.ref(self)
+		
+		self.numverts = topology.numverts
+		self.numloops = topology.numloops
+		self.numpolys = topology.numpolys
+		self.numedges = topology.numedges
+		
+		# vertices
+		if co is None:
+			co = read_attribute(mesh.vertices, 'co', np.float32, 3)
+		self.co = co
+		
+		# polygons
+		self.poly_loopstart = topology.poly_loopstart
+		self.poly_looptotal = topology.poly_looptotal
+		self.poly_normals = read_attribute(mesh.polygons, 'normal', np.float32, 3)
+		self.poly_area = read_attribute(mesh.polygons, 'area', np.float32)
+		
+		# loops
+		self.loop_vert = topology.loop_vert
+		self.loop_edge = topology.loop_edge
+		self.loop_poly = topology.loop_poly
+		
+		# corner data, built on first use
+		self.corner_angle = None
+		self.corner_edgelengths = None
+		
+		# surface search structure, built by normeditor_spatial on first use
+		self.surfaceindex = None
+		
+		# owning cache and key, told about size changes of lazily built data
+		self.cache = None
+		self.cachekey = None
+		
+		self.freeze()
+	
+	def edgeloops(self):
+		return self.topology.edgeloops()
+	
+	def loopneighbors(self):
+		return self.topology.loopneighbors()
+	
+	def vertfaces(self):
+		return self.topology.vertfaces()
+	
+	# angle and adjacent edge lengths at each polygon corner (loop)
+	# - corner_edgelengths is (loops, 2): edge to the next and to the previous vertex
+	# - loops: only compute these corners, unless all corners are cached already
+	def corners(self, loops=None):
+		if self.corner_angle is not None:
+			if loops is None:
+				return self.corner_angle, self.corner_edgelengths
+			return self.corner_angle[loops], self.corner_edgelengths[loops]
+		
+		if loops is not None:
+			return self.corner_geometry(loops)
+		
+		self.corner_angle, self.corner_edgelengths = self.corner_geometry(
+			np.arange(self.numloops, dtype=np.int32))
+		self.freeze()
+		return self.corner_angle, self.corner_edgelengths
+	
+	def corner_geometry(self, loops):
+		loop_next, loop_prev = self.loopneighbors()
+		loopco = self.co[self.loop_vert[loops]]
+		edgenext = self.co[self.loop_vert[loop_next[loops]]] - loopco
+		edgeprev = self.co[self.loop_vert[loop_prev[loops]]] - loopco
+		
+		lengths = np.empty((len(loops), 2), dtype=np.float32)
+		lengths[:, 0] = np.sqrt((edgenext * edgenext).sum(axis=1))
+		lengths[:, 1] = np.sqrt((edgeprev * edgeprev).sum(axis=1))
+		
+		cosangle = (normalize_rows(edgenext) * normalize_rows(edgeprev)).sum(axis=1)
+		angle = np.arccos(np.clip(cosangle, -1.0, 1.0)).astype(np.float32)
+		# degenerate corners don't contribute
+		angle[(lengths == 0.0).any(axis=1)] = 0.0
+		
+		return angle, lengths
+	
+	# makes all arrays read-only, they are shared by every snapshot of the mesh
+	# - called after building data on demand, updates the cache's memory total
+	def freeze(self):
+		for v in vars(self).values():
+			if isinstance(v, np.ndarray):
+				v.flags.writeable = False
+		
+		if self.cache is not None:
+			self.cache.resize(self)
+	
+	# memory used by all arrays, including the topology's and the surface index
+	def nbytes(self):
+		shared = set(id(v) for v in vars(self.topology).values())
+		own = sum(v.nbytes for v in vars(self).values()
+			if isinstance(v, np.ndarray) and id(v) not in shared)
+		if self.surfaceindex is not None:
+			own += self.surfaceindex.nbytes()
+		return own + self.topology.nbytes()
+
+
+#######################################
+# LRU cache of MeshGeometry by mesh name
+#
+# - entries are only reused if the mesh's topology and coordinates still match
+# - if only coordinates changed, the entry's topology is reused
+# - least recently used entries are dropped once the memory budget is exceeded
+# - entries are (fingerprint, geometry, nbytes), totalbytes is their running sum
+class MeshGeometryCache:
+	def __init__(self, budget):
+		self.budget = budget
+		self.entries = OrderedDict()
+		self.totalbytes = 0
+		self.hits = 0
+		self.misses = 0
+		self.evictions = 0
+	
+	def get(self, mesh):
+		co = read_attribute(mesh.vertices, 'co', np.float32, 3)
+		topology = topology_fingerprint(mesh)
+		fingerprint = (topology, zlib.crc32(co))
+		
+		entry = self.entries.get(mesh.name)
+		if entry is not None and entry[0] == fingerprint:
+			self.hits += 1
+			self.entries.move_to_end(mesh.name)
+			return entry[1]
+		
+		self.misses += 1
+		if entry is not None and entry[0][0] == topology:
+			geometry = MeshGeometry(mesh, co, entry[1].topology)
+		else:
+			geometry = MeshGeometry(mesh, co)
+		self.store(mesh.name, fingerprint, geometry)
+		return geometry
+	
+	# cached topology of mesh if its connectivity still matches, else None
+	def topology(self, mesh):
+		entry = self.entries.get(mesh.name)
+		if entry is not None and entry[0][0] == topology_fingerprint(mesh):
+			return entry[1].topology
+		return None
+	
+	def store(self, key, fingerprint, geometry):
+		old = self.entries.pop(key, None)
+		if old is not None:
+			self.totalbytes -= old[2]
+			old[1].cache = None
+		
+		geometry.cache = self
+		geometry.cachekey = key
+		size = geometry.nbytes()
+		self.entries[key] = (fingerprint, geometry, size)
+		self.totalbytes += size
+		self.evict()
+	
+	# updates the memory total after geometry built more data
+	def resize(self, geometry):
+		entry = self.entries.get(geometry.cachekey)
+		if entry is not None and entry[1] is geometry:
+			size = geometry.nbytes()
+			self.entries[geometry.cachekey] = (entry[0], geometry, size)
+			self.totalbytes += size - entry[2]
+			self.evict()
+	
+	# memory used by all cached entries
+	def nbytes(self):
+		return self.totalbytes
+	
+	# drops least recently used entries until the budget is met
+	# - the most recent entry is always kept
+	def evict(self):
+		while len(self.entries) > 1 and self.totalbytes > self.budget:
+			entry = self.entries.popitem(last=False)[1]
+			entry[1].cache = None
+			self.totalbytes -= entry[2]
+			self.evictions += 1
+	
+	def clear(self):
+		for entry in self.entries.values():
+			entry[1].cache = None
+		self.entries.clear()
+		self.totalbytes = 0
+	
+	def stats(self):
+		return {
+			'entries': len(self.entries),
+			'nbytes': self.nbytes(),
+			'budget': self.budget,
+			'hits': self.hits,
+			'misses': self.misses,
+			'evictions': self.evictions,
+		}
+
+
+# shared cache used by all snapshots
+meshcache = MeshGeometryCache(256 * 1024 * 1024)
+
+
+#######################################
+# Columnar mesh data shared by all operators
+#
+# - geometry comes from meshcache, normals and selection are read every time
+# - meshes in edit mode are synced from the edit mesh first
+# - 'normals' and 'elem_indices' are per element of the current
+#   editing mode: loops for split normals, vertices for vertex normals
+class MeshSnapshot:
+	def __init__(self, mesh, split=None):
+		self.split = mesh.use_auto_smooth if split is None else split
+		
+		sync_editmode(mesh)
+		geometry = meshcache.get(mesh)
+		self.geometry = geometry
+		self.numverts = geometry.numverts
+		self.numloops = geometry.numloops
+		self.numpolys = geometry.numpolys
+		self.co = geometry.co
+		self.poly_loopstart = geometry.poly_loopstart
+		self.poly_looptotal = geometry.poly_looptotal
+		self.poly_normals = geometry.poly_normals
+		self.poly_area = geometry.poly_area
+		self.loop_vert = geometry.loop_vert
+		self.loop_poly = geometry.loop_poly
+		self.loop_edge = geometry.loop_edge
+		
+		# current state
+		self.vert_normals = read_attribute(mesh.vertices, 'normal', np.float32, 3)
+		self.vert_select = read_attribute(mesh.vertices, 'select', bool)
+		self.poly_select = read_attribute(mesh.polygons, 'select', bool)
+		
+		self.loop_normals = None
+		if self.split:
+			mesh.calc_normals_split()
+			self.loop_normals = read_attribute(mesh.loops, 'normal', np.float32, 3)
+			mesh.free_normals_split()
+	
+	# current normals of the editing mode's elements
+	@property
+	def normals(self):
+		if self.split:
+			return self.loop_normals
+		return self.vert_normals
+	
+	# number of elements in the editing mode
+	@property
+	def numelems(self):
+		if self.split:
+			return self.numloops
+		return self.numverts
+	
+	# candidate normals of each vertex as a compressed sparse row index
+	# - split normals: the normals of the vertex's corners (loops)
+	# - vertex normals: the vertex normal
+	# returns (offsets, normals), entries of vertex v are offsets[v]:offsets[v + 1]
+	def vertex_normalsets(self):
+		if self.split:
+			vf_offsets, vf_polys, vf_loops = self.geometry.vertfaces()
+			return vf_offsets, self.loop_normals[vf_loops]
+		return np.arange(self.numverts + 1, dtype=np.int32), self.vert_normals
+	
+	# sorted indices of the selected elements in the editing mode
+	# - None if all elements are edited (editselection off)
+	# - split normals use face selection if byface is set
+	# - loops are gathered from the selected vertices/faces, not from a per-loop mask
+	def elem_indices(self, editselection, byface=False):
+		if not editselection:
+			return None
+		if not self.split:
+			return np.flatnonzero(self.vert_select).astype(np.int32)
+		
+		if byface:
+			polys = np.flatnonzero(self.poly_select)
+			loops = expand_ranges(self.poly_loopstart[polys], self.poly_looptotal[polys])[0]
+		else:
+			vf_offsets, vf_polys, vf_loops = self.geometry.vertfaces()
+			loops = vf_loops[csr_rows(vf_offsets, np.flatnonzero(self.vert_select))[0]]
+		return np.sort(loops)
+
+
+# candidate normals of several snapshots' vertices merged into one point set
+# - one point per vertex with normals, vertices without (loose vertices of
+#   split meshes) are left out
+# returns (co, offsets, normals): point positions and the points' candidate
+# normals as a CSR index
+def merged_normalsets(snapshots):
+	co = []
+	counts = []
+	normals = []
+	for meshdata in snapshots:
+		offsets, normalsets = meshdata.vertex_normalsets()
+		vertcounts = offsets[1:] - offsets[:-1]
+		points = np.flatnonzero(vertcounts)
+		
+		co.append(meshdata.co[points])
+		counts.append(vertcounts[points])
+		normals.append(normalsets)
+	
+	counts = np.concatenate(counts) if len(counts) > 0 else np.zeros(0, dtype=np.int32)
+	offsets = np.zeros(len(counts) + 1, dtype=np.int32)
+	np.cumsum(counts, out=offsets[1:])
+	
+	if len(co) == 0:
+		return np.zeros((0, 3), dtype=np.float32), offsets, np.zeros((0, 3), dtype=np.float32)
+	return np.concatenate(co), offsets, np.concatenate(normals)
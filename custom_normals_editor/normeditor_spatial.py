@@ -0,0 +1,326 @@
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# ##### END GPL LICENSE BLOCK #####
+
+from mathutils import kdtree
+import numpy as np
+import weakref
+
+try:
+	from mathutils.bvhtree import BVHTree
+except ImportError:
+	# Blender < 2.76, no surface transfer
+	BVHTree = None
+
+from .normeditor_meshdata import expand_ranges
+
+
+#######################################
+# Spatial indices for Transfer
+#
+# - built once per set of source points, queried with all destination points
+# - nearest() returns (indices, dists) per query point, index -1 where
+#   nothing is closer than maxdist
+# - knearest() returns (queries, k) arrays of the k nearest points within
+#   maxdist, sorted by distance and padded with -1 (dist inf)
+
+# source points in a mathutils KD-tree
+class KDTreeIndex:
+	def __init__(self, points):
+		self.numpoints = len(points)
+		self.tree = kdtree.KDTree(self.numpoints)
+		for i, co in enumerate(points.tolist()):
+			self.tree.insert(co, i)
+		self.tree.balance()
+	
+	def nearest(self, queries, maxdist):
+		indices = np.full(len(queries), -1, dtype=np.int32)
+		dists = np.full(len(queries), np.inf, dtype=np.float64)
+		if self.numpoints > 0:
+			find = self.tree.find
+			for j, co in enumerate(queries.tolist()):
+				co, i, dist = find(co)
+				if dist < maxdist:
+					indices[j] = i
+					dists[j] = dist
+		
+		return indices, dists
+	
+	def knearest(self, queries, k, maxdist):
+		indices = np.full((len(queries), k), -1, dtype=np.int32)
+		dists = np.full((len(queries), k), np.inf, dtype=np.float64)
+		if self.numpoints > 0:
+			find_n = self.tree.find_n
+			for j, co in enumerate(queries.tolist()):
+				found = [(i, dist) for co, i, dist in find_n(co, k) if dist < maxdist]
+				if len(found) > 0:
+					indices[j, :len(found)], dists[j, :len(found)] = zip(*found)
+		
+		return indices, dists
+
+
+# cell offsets of a cell's 3x3x3 neighborhood
+grid_neighbors = np.array(
+	[(x, y, z) for x in (-1, 0, 1) for y in (-1, 0, 1) for z in (-1, 0, 1)], dtype=np.int64)
+
+
+# hashes integer cell coordinates (..., 3)
+def cell_hash(cells):
+	return (cells[..., 0] * 73856093) ^ (cells[..., 1] * 19349663) ^ (cells[..., 2] * 83492791)
+
+
+# source points hashed into a uniform grid with cells of maxdist
+# - cells are hashed into a power of two bucket table (about two buckets per
+#   point), hash collisions only add candidates
+# - a query only checks the buckets of the 27 cells around its own, all
+#   queries are processed as arrays in batches of about batchcandidates
+#   (query, point) pairs, at most maxbatchsize queries
+# - ties are resolved to the lowest point index, like a brute force search
+class HashGridIndex:
+	batchcandidates = 1048576
+	maxbatchsize = 65536
+	
+	def __init__(self, points, cellsize):
+		self.points = np.asarray(points, dtype=np.float64)
+		self.cellsize = float(cellsize)
+		
+		tablesize = 1
+		while tablesize < 2 * len(self.points):
+			tablesize *= 2
+		self.bucketmask = tablesize - 1
+		
+		buckets = self.point_buckets(self.points)
+		self.order = np.argsort(buckets, kind='mergesort').astype(np.int32)
+		self.counts = np.bincount(buckets, minlength=tablesize).astype(np.int32)
+		self.starts = np.zeros(tablesize, dtype=np.int32)
+		np.cumsum(self.counts[:-1], out=self.starts[1:])
+		
+		self.batchsize = int(min(self.maxbatchsize,
+			max(1, self.batchcandidates // max(self.expected_candidates(), 1.0))))
+		
+		self.numqueries = 0
+		self.numcandidates = 0
+	
+	def point_buckets(self, co, neighbors=None):
+		cells = np.floor(co / self.cellsize).astype(np.int64)
+		if neighbors is not None:
+			cells = cells[:, None, :] + neighbors[None, :, :]
+		return (cell_hash(cells) & self.bucketmask).ravel()
+	
+	# expected candidates per query for points distributed like the source
+	def expected_candidates(self):
+		if len(self.points) == 0:
+			return 0.0
+		return 27.0 * (self.counts.astype(np.float64) ** 2).sum() / len(self.points)
+	
+	# (query, point) index pairs from the buckets around each query
+	# - a point can show up twice for one query if two of its cells share a bucket
+	def candidates(self, queries):
+		buckets = self.point_buckets(queries, grid_neighbors)
+		queryids = np.repeat(np.arange(len(queries), dtype=np.int64), 27)
+		
+		hit = self.counts[buckets] > 0
+		buckets = buckets[hit]
+		entries, rowids = expand_ranges(self.starts[buckets], self.counts[buckets])
+		return queryids[hit][rowids], self.order[entries]
+	
+	def nearest(self, queries, maxdist):
+		indices, dists = self.knearest(queries, 1, maxdist)
+		return indices[:, 0], dists[:, 0]
+	
+	def knearest(self, queries, k, maxdist):
+		indices = np.full((len(queries), k), -1, dtype=np.int32)
+		dists = np.full((len(queries), k), np.inf, dtype=np.float64)
+		if len(self.points) == 0:
+			return indices, dists
+		
+		queries = np.asarray(queries, dtype=np.float64)
+		for first in range(0, len(queries), self.batchsize):
+			batch = queries[first:first + self.batchsize]
+			queryids, pointids = self.candidates(batch)
+			self.numqueries += len(batch)
+			self.numcandidates += len(queryids)
+			
+			if k > 1:
+				# drop points reached twice through colliding buckets
+				pairs = np.unique(queryids * len(self.points) + pointids)
+				queryids = pairs // len(self.points)
+				pointids = (pairs % len(self.points)).astype(np.int32)
+			
+			offsets = self.points[pointids] - batch[queryids]
+			pointdists = np.sqrt((offsets * offsets).sum(axis=1))
+			inrange = pointdists < maxdist
+			queryids = queryids[inrange]
+			pointids = pointids[inrange]
+			pointdists = pointdists[inrange]
+			
+			# rank candidates per query by distance, lowest point index on ties
+			order = np.lexsort((pointids, pointdists, queryids))
+			queryids = queryids[order]
+			groupstart = np.ones(len(order), dtype=bool)
+			groupstart[1:] = queryids[1:] != queryids[:-1]
+			groupstart = np.flatnonzero(groupstart)
+			ranks = np.arange(len(order)) - np.repeat(
+				groupstart, np.diff(np.append(groupstart, len(order))))
+			
+			keep = ranks < k
+			rows = first + queryids[keep]
+			indices[rows, ranks[keep]] = pointids[order[keep]]
+			dists[rows, ranks[keep]] = pointdists[order[keep]]
+		
+		return indices, dists
+	
+	# points per occupied grid cell, sorted by cell
+	def cell_counts(self):
+		if len(self.points) == 0:
+			return np.zeros(0, dtype=np.int64)
+		cells = np.floor(self.points / self.cellsize).astype(np.int64)
+		cells = cells[np.lexsort(cells.T[::-1])]
+		firsts = np.flatnonzero(np.concatenate(([True], (cells[1:] != cells[:-1]).any(axis=1))))
+		return np.diff(np.append(firsts, len(cells)))
+	
+	# 'cells' are distinct occupied grid cells, 'buckets' non-empty hash buckets
+	# (fewer than cells if cells collide)
+	def stats(self):
+		cellcounts = self.cell_counts()
+		return {
+			'points': len(self.points),
+			'cells': len(cellcounts),
+			'buckets': int(np.count_nonzero(self.counts)),
+			'occupancy': (len(self.points) / len(cellcounts)) if len(cellcounts) > 0 else 0.0,
+			'maxoccupancy': int(cellcounts.max()) if len(cellcounts) > 0 else 0,
+			'maxbucket': int(self.counts.max()) if len(self.counts) > 0 else 0,
+			'candidates': (self.numcandidates / self.numqueries) if self.numqueries > 0 else 0.0,
+			'batchsize': self.batchsize,
+		}
+
+
+# grid above this many expected candidates per query falls back to the KD-tree
+grid_maxcandidates = 256
+
+
+# last grid built by build_index, for grid_stats
+last_gridindex = [None]
+
+
+# spatial index for nearest searches within maxdist
+# - a hash grid for small radii, the KD-tree for unlimited or large radii
+#   (cells would hold too many points)
+def build_index(points, maxdist):
+	last_gridindex[0] = None
+	if np.isfinite(maxdist) and maxdist > 0.0 and len(points) > 0:
+		grid = HashGridIndex(points, maxdist)
+		if grid.expected_candidates() <= grid_maxcandidates:
+			last_gridindex[0] = grid
+			return grid
+	
+	return KDTreeIndex(points)
+
+
+# stats of the last grid used by Transfer, empty if it used the KD-tree
+def grid_stats():
+	if last_gridindex[0] is None:
+		return {}
+	return last_gridindex[0].stats()
+
+
+# source polygons of one or more mesh geometries in a mathutils BVH tree,
+# for closest points on the surface
+class SurfaceIndex:
+	def __init__(self, geometries):
+		co = []
+		polys = []
+		vertbase = 0
+		for geometry in geometries:
+			co.extend(geometry.co.tolist())
+			if geometry.numpolys > 0:
+				polyverts = np.split(geometry.loop_vert + vertbase, geometry.poly_loopstart[1:])
+				polys.extend(poly.tolist() for poly in polyverts)
+			vertbase += geometry.numverts
+		
+		# first polygon of each geometry in the merged tree
+		self.polystarts = np.zeros(len(geometries) + 1, dtype=np.int32)
+		np.cumsum([geometry.numpolys for geometry in geometries], out=self.polystarts[1:])
+		self.tree = BVHTree.FromPolygons(co, polys, all_triangles=False)
+		
+		self.numverts = len(co)
+		self.numtris = sum(geometry.numloops - 2 * geometry.numpolys for geometry in geometries)
+	
+	# estimated memory of the tree: float vertices, per triangle its vertex
+	# indices and about one BVH node
+	def nbytes(self):
+		return self.polystarts.nbytes + self.numverts * 12 + self.numtris * (12 + 64)
+	
+	# closest surface point within maxdist of each query
+	# returns (tags, polys, locations): geometry index and its polygon, -1 where
+	# nothing is in range
+	def closest(self, queries, maxdist):
+		polys = np.full(len(queries), -1, dtype=np.int32)
+		locations = np.zeros((len(queries), 3), dtype=np.float64)
+		if self.polystarts[-1] > 0:
+			find_nearest = self.tree.find_nearest
+			for j, co in enumerate(queries.tolist()):
+				location, normal, poly, dist = find_nearest(co, maxdist)
+				if poly is not None:
+					polys[j] = poly
+					locations[j] = location
+		
+		tags = np.full(len(queries), -1, dtype=np.int32)
+		found = polys >= 0
+		tags[found] = np.searchsorted(self.polystarts, polys[found], side='right') - 1
+		polys[found] -= self.polystarts[tags[found]]
+		return tags, polys, locations
+
+
+# last merged surface index: (weak references to its geometries, index)
+# - released as soon as one of its geometries is freed (evicted from the mesh cache)
+merged_surfaceindex = [(), None]
+
+
+def clear_surfaceindex():
+	merged_surfaceindex[:] = [(), None]
+
+
+# drops all kept indices
+def clear_indices():
+	last_gridindex[0] = None
+	clear_surfaceindex()
+
+
+def release_surfaceindex(ref):
+	if any(ref is cached for cached in merged_surfaceindex[0]):
+		clear_surfaceindex()
+
+
+# surface index of one or more mesh geometries, built once
+# - a single geometry's index is kept with the cached geometry and counts
+#   towards the cache's memory budget, the last merged index is kept until
+#   other geometries are requested
+def surface_index(geometries):
+	if len(geometries) == 1:
+		if geometries[0].surfaceindex is None:
+			geometries[0].surfaceindex = SurfaceIndex(geometries)
+			geometries[0].freeze()
+		return geometries[0].surfaceindex
+	
+	cached, index = merged_surfaceindex
+	if len(cached) != len(geometries) or any(ref() is not b for ref, b in zip(cached, geometries)):
+		clear_surfaceindex()
+		index = SurfaceIndex(geometries)
+		refs = tuple(weakref.ref(geometry, release_surfaceindex) for geometry in geometries)
+		merged_surfaceindex[:] = [refs, index]
+	return index